@@ -4,14 +4,32 @@ import os
 
 db = SQLAlchemy()
 
-def create_app():
+def create_app(production=None):
+    if production is None:
+        production = os.environ.get('DDTIMER_PRODUCTION') == '1'
     app = Flask(__name__)
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
+    # memory:// keeps session states in process (app/storage); SQLAlchemy
+    # still gets a throwaway SQLite for everything else
+    from .storage import sqlalchemy_url
+    database_url = sqlalchemy_url(os.environ.get('DATABASE_URL'))
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Rejects oversized uploads from Content-Length before the body is read
+    from .uploads import MAX_UPLOAD_BYTES
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024
+    # Pool size, overflow, timeouts and pre-ping from DDTIMER_DB_* (app/pool.py)
+    from .pool import engine_options
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(database_url, production)
     db.init_app(app)
 
-    from .routes import main
+    from .routes import main, scan_writer, backgrounds, store
     app.register_blueprint(main)
-    app.config['TEMPLATES_AUTO_RELOAD'] = True
+    store.init_app(app)
+    if store.persistent:
+        scan_writer.init_app(app)
+    backgrounds.init_app(app)
+    from . import compression
+    compression.init_app(app)
+    app.config['TEMPLATES_AUTO_RELOAD'] = not production
 
     return app
\ No newline at end of file
@@ -0,0 +1,276 @@
+import asyncio
+import contextlib
+import os
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+from ddtrace.contrib.asgi import TraceMiddleware
+from werkzeug.http import dump_cookie, parse_cookie
+
+from .routes import (
+    DEVICE_COOKIE,
+    DEVICE_COOKIE_MAX_AGE,
+    DONE_DEDUP,
+    DONE_PAGE,
+    PING_MAX_WAIT,
+    STREAM_HEARTBEAT,
+    counters,
+    current_state_version,
+    device_token,
+    metrics,
+    record_scan,
+    reset_scans,
+    state_changes,
+    state_event,
+)
+
+# ASGI front for the burst endpoints. /done, /ping, /ping/stream, /reset and
+# /api/session-state/stream are answered on the event loop without a thread
+# per connection; every other path is handed to the Flask app through
+# a2wsgi's thread pool. Both paths use the same counter store and state
+# change feed, so they can run side by side. The Flask integration doesn't
+# see the fast paths, so each is wrapped in ddtrace's ASGI middleware and
+# traced as an asgi.request span; Flask paths keep their flask.request spans.
+
+
+class AsyncSessionNotifier:
+    """asyncio counterpart of events.SessionNotifier for one event loop."""
+
+    def __init__(self, poll_interval=None):
+        self.poll_interval = poll_interval
+        self._waiters = {}  # session_id -> set of asyncio.Event
+
+    def notify(self, session_id):
+        for event in self._waiters.get(session_id, ()):
+            event.set()
+
+    async def wait_for(self, session_id, predicate, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not predicate():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            event = asyncio.Event()
+            waiters = self._waiters.setdefault(session_id, set())
+            waiters.add(event)
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, self.poll_interval or remaining))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                waiters.discard(event)
+                if not waiters:
+                    self._waiters.pop(session_id, None)
+        return True
+
+
+def _arg(scope, name, default=None, type=str):
+    values = parse_qs(scope["query_string"].decode("latin-1")).get(name)
+    if not values:
+        return default
+    try:
+        return type(values[0])
+    except ValueError:
+        return default
+
+
+def _cookie(scope, name):
+    for key, value in scope["headers"]:
+        if key == b"cookie":
+            return parse_cookie(value.decode("latin-1")).get(name)
+    return None
+
+
+async def _respond(send, body, content_type, status=200, headers=()):
+    body = body.encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def create_asgi_app(flask_app):
+    wsgi = WSGIMiddleware(flask_app, workers=int(os.environ.get("DDTIMER_THREADS", 8)))
+    notifier = AsyncSessionNotifier(poll_interval=counters.poll_interval)
+
+    def state_version(session_id):
+        with flask_app.app_context():
+            return current_state_version(session_id)
+
+    async def done(scope, receive, send):
+        with metrics.timer("done"):
+            session_id = _arg(scope, "session", "default")
+            token, new, headers = None, False, []
+            if DONE_DEDUP:
+                token, new = device_token(_arg(scope, "device"), _cookie(scope, DEVICE_COOKIE))
+            if new:
+                cookie = dump_cookie(DEVICE_COOKIE, token, max_age=DEVICE_COOKIE_MAX_AGE,
+                                     httponly=True, samesite="Lax")
+                headers.append((b"set-cookie", cookie.encode("latin-1")))
+            record_scan(session_id, token)
+            notifier.notify(session_id)
+            await _respond(send, DONE_PAGE, b"text/html; charset=utf-8", headers=headers)
+
+    async def ping(scope, receive, send):
+        session_id = _arg(scope, "session", "default")
+        since = _arg(scope, "since", type=int)
+        with metrics.timer("ping" if since is None else "ping_wait"):
+            if since is not None:
+                wait = min(_arg(scope, "wait", PING_MAX_WAIT, type=float), PING_MAX_WAIT)
+                await notifier.wait_for(session_id, lambda: counters.get(session_id) != since, max(wait, 0))
+            await _respond(send, str(counters.get(session_id)), b"text/html; charset=utf-8")
+
+    async def reset(scope, receive, send):
+        session_id = _arg(scope, "session", "default")
+        reset_scans(session_id)
+        notifier.notify(session_id)
+        await _respond(send, "OK", b"text/html; charset=utf-8")
+
+    async def ping_stream(scope, receive, send):
+        session_id = _arg(scope, "session", "default")
+        with_state = _arg(scope, "state") == "1"
+        loop = asyncio.get_running_loop()
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+            notifier.notify(session_id)
+
+        def on_change():
+            # Runs on the publishing (request or listener) thread
+            loop.call_soon_threadsafe(notifier.notify, session_id)
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            with contextlib.ExitStack() as stack:
+                watch = version = None
+                if with_state:
+                    # Subscribe before reading, so a write in between isn't missed
+                    watch = stack.enter_context(state_changes.watch(session_id, on_change))
+                    version = await loop.run_in_executor(None, state_version, session_id)
+                await send({
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", b"text/event-stream; charset=utf-8"),
+                        (b"cache-control", b"no-cache"),
+                        (b"x-accel-buffering", b"no"),
+                    ],
+                })
+                last = counters.get(session_id)
+                chunk = f"retry: 2000\ndata: {last}\n\n"
+                if with_state:
+                    chunk += state_event(version, "state")
+                while not disconnected.is_set():
+                    if chunk:
+                        await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+                    changed = await notifier.wait_for(
+                        session_id,
+                        lambda: (disconnected.is_set() or counters.get(session_id) != last
+                                 or (watch is not None and watch.pending)),
+                        STREAM_HEARTBEAT,
+                    )
+                    chunk = ""
+                    if counters.get(session_id) != last:
+                        last = counters.get(session_id)
+                        chunk += f"data: {last}\n\n"
+                    if watch is not None and not disconnected.is_set():
+                        pending = watch.pending
+                        current = watch.take() if pending else None
+                        if current is None and (pending or not changed):
+                            current = await loop.run_in_executor(None, state_version, session_id)
+                        if current is not None and current != version:
+                            version = current
+                            chunk += state_event(version, "state")
+                    if not chunk and not changed:
+                        chunk = ": keep-alive\n\n"
+        finally:
+            watcher.cancel()
+
+    async def state_stream(scope, receive, send):
+        session_id = _arg(scope, "session", "default")
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+            wake.set()
+
+        def on_change():
+            # Runs on the publishing (request or listener) thread
+            loop.call_soon_threadsafe(wake.set)
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            with state_changes.watch(session_id, on_change) as watch:
+                # Read after subscribing, so a write in between isn't missed
+                last = await loop.run_in_executor(None, state_version, session_id)
+                await send({
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", b"text/event-stream; charset=utf-8"),
+                        (b"cache-control", b"no-cache"),
+                        (b"x-accel-buffering", b"no"),
+                    ],
+                })
+                chunk = "retry: 2000\n" + state_event(last)
+                while not disconnected.is_set():
+                    await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+                    chunk = ""
+                    while not chunk:
+                        try:
+                            await asyncio.wait_for(wake.wait(), STREAM_HEARTBEAT)
+                        except asyncio.TimeoutError:
+                            pass
+                        if disconnected.is_set():
+                            break
+                        changed = wake.is_set()
+                        wake.clear()
+                        version = watch.take() if changed else None
+                        if version is None:
+                            version = await loop.run_in_executor(None, state_version, session_id)
+                        if version != last:
+                            last = version
+                            chunk = state_event(version)
+                        elif not changed:
+                            chunk = ": keep-alive\n\n"
+        finally:
+            watcher.cancel()
+
+    fast_paths = {
+        ("GET", "/done"): done,
+        ("GET", "/ping"): ping,
+        ("GET", "/ping/stream"): ping_stream,
+        ("POST", "/reset"): reset,
+        ("GET", "/api/session-state/stream"): state_stream,
+    }
+    fast_paths = {key: TraceMiddleware(handler) for key, handler in fast_paths.items()}
+
+    async def application(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        handler = fast_paths.get((scope.get("method"), scope.get("path")))
+        if handler is not None:
+            return await handler(scope, receive, send)
+        return await wsgi(scope, receive, send)
+
+    return application
@@ -0,0 +1,224 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Resized, recompressed derivatives of background images.
+#
+# Every uploaded background, and every large bundled image on its first
+# /bg/ request, is rendered at a few display widths as WebP and JPEG in a
+# worker pool, off the request thread. Variants are written to
+# static/variants/ under content-hashed names so they can be served as
+# immutable. A small sidecar JSON per source image lists its variants, or
+# the error that stopped them, so a failing image isn't retried until it
+# changes. A lock file next to it keeps other workers from building the
+# same variants at the same time. build_variants.py builds the bundled
+# images ahead of time (the Docker image does so at build time).
+
+VARIANT_WIDTHS = (640, 1280, 1920)
+VARIANT_FORMATS = {"webp": ("WEBP", {"quality": 80, "method": 4}),
+                   "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True})}
+# Bundled images below this size are icons/dots, not backgrounds
+BUNDLED_MIN_BYTES = 256 * 1024
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+IMAGE_WORKERS = int(os.environ.get("DDTIMER_IMAGE_WORKERS", 2))
+# A build lock older than this was left by a worker that died mid-build
+BUILD_LOCK_TIMEOUT = 300
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundVariants:
+    def __init__(self, workers=IMAGE_WORKERS):
+        self.workers = workers
+        self.static_dir = None
+        self.variants_dir = None
+        self._manifests = {}  # source filename -> manifest dict
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def init_app(self, app):
+        # Nothing is built here: create_app runs in the gunicorn master,
+        # where a thread pool and PIL would only be inherited by every worker
+        self.init_dirs(app.static_folder)
+
+    def init_dirs(self, static_dir):
+        self.static_dir = static_dir
+        self.variants_dir = os.path.join(self.static_dir, "variants")
+        os.makedirs(self.variants_dir, exist_ok=True)
+
+    def bundled_images(self):
+        """Shipped images large enough to be backgrounds."""
+        names = []
+        for name in sorted(os.listdir(self.static_dir)):
+            path = os.path.join(self.static_dir, name)
+            if (name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path)
+                    and os.path.getsize(path) >= BUNDLED_MIN_BYTES):
+                names.append(name)
+        return names
+
+    def _pool(self):
+        # Worker threads don't survive fork; build the pool in the process using it
+        if self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bg-variants")
+            self._executor_pid = os.getpid()
+            self._pending = set()
+        return self._executor
+
+    def submit(self, filename):
+        """Queue variant generation for static/<filename> unless it is current.
+
+        Also skipped when the last attempt on this version of the file failed.
+        """
+        if self.variants_dir is None or not filename.lower().endswith(IMAGE_EXTENSIONS):
+            return
+        manifest = self.manifest(filename)
+        if manifest is not None and manifest.get("source_stamp") == self._stamp(filename):
+            return
+        with self._lock:
+            pool = self._pool()
+            if filename in self._pending:
+                return
+            self._pending.add(filename)
+        pool.submit(self._process_logged, filename)
+
+    def _stamp(self, filename):
+        st = os.stat(os.path.join(self.static_dir, filename))
+        return [st.st_mtime_ns, st.st_size]
+
+    def _manifest_path(self, filename):
+        return os.path.join(self.variants_dir, f"{filename}.json")
+
+    def manifest(self, filename):
+        """Variant manifest of a source image, or None if not generated (yet)."""
+        manifest = self._manifests.get(filename)
+        if manifest is not None:
+            return manifest
+        try:
+            with open(self._manifest_path(filename)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._manifests[filename] = manifest
+        return manifest
+
+    def _process_logged(self, filename):
+        lock = None
+        try:
+            lock = self._acquire_build_lock(filename)
+            if lock is not None:
+                self.process(filename)
+        except Exception as exc:
+            logger.warning("Could not build background variants for %s: %s", filename, exc)
+            self._remember_failure(filename, exc)
+        finally:
+            if lock is not None:
+                _unlink(lock)
+            with self._lock:
+                self._pending.discard(filename)
+
+    def _acquire_build_lock(self, filename):
+        """Lock file path, or None when another process is building filename."""
+        lock = self._manifest_path(filename) + ".lock"
+        for _ in range(2):
+            try:
+                os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return lock
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock) < BUILD_LOCK_TIMEOUT:
+                        return None
+                except FileNotFoundError:
+                    continue  # released meanwhile
+                _unlink(lock)
+        return None
+
+    def _remember_failure(self, filename, exc):
+        try:
+            stamp = self._stamp(filename)
+        except OSError:
+            return  # source gone; nothing to remember
+        manifest = {"source": filename, "source_stamp": stamp, "variants": [], "error": str(exc)}
+        _write_atomic(self._manifest_path(filename), json.dumps(manifest).encode())
+        self._manifests[filename] = manifest
+
+    def process(self, filename):
+        from PIL import Image
+
+        source = os.path.join(self.static_dir, filename)
+        stamp = self._stamp(filename)
+        stem = os.path.splitext(filename)[0]
+        variants = []
+        with Image.open(source) as original:
+            original.load()
+            widths = [w for w in VARIANT_WIDTHS if w < original.width] or [original.width]
+            for width in widths:
+                height = round(original.height * width / original.width)
+                resized = original.resize((width, height), Image.LANCZOS)
+                for ext, (fmt, options) in VARIANT_FORMATS.items():
+                    image = resized
+                    if fmt == "JPEG" and image.mode != "RGB":
+                        image = image.convert("RGB")
+                    elif fmt == "WEBP" and image.mode not in ("RGB", "RGBA"):
+                        image = image.convert("RGBA")
+                    body = _encode(image, fmt, options)
+                    digest = hashlib.sha256(body).hexdigest()[:16]
+                    name = f"{stem}-{width}w.{digest}.{ext}"
+                    _write_atomic(os.path.join(self.variants_dir, name), body)
+                    variants.append({"width": width, "format": ext, "file": name, "bytes": len(body)})
+        manifest = {"source": filename, "source_stamp": stamp, "variants": variants}
+        _write_atomic(self._manifest_path(filename), json.dumps(manifest).encode())
+        self._manifests[filename] = manifest
+        logger.info("Built %d background variants for %s", len(variants), filename)
+        return manifest
+
+    def discard(self, filename):
+        """Delete the variants and manifest of a source image."""
+        manifest = self.manifest(filename)
+        self._manifests.pop(filename, None)
+        names = [v["file"] for v in manifest["variants"]] if manifest else []
+        for name in names + [f"{filename}.json"]:
+            try:
+                os.unlink(os.path.join(self.variants_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def best_variant(self, filename, width, accept_webp):
+        """Smallest variant at least `width` wide (else the widest), or None."""
+        manifest = self.manifest(filename)
+        if manifest is None:
+            return None
+        ext = "webp" if accept_webp else "jpg"
+        candidates = sorted((v for v in manifest["variants"] if v["format"] == ext), key=lambda v: v["width"])
+        if not candidates:
+            return None
+        for variant in candidates:
+            if variant["width"] >= width:
+                return variant["file"]
+        return candidates[-1]["file"]
+
+
+def _encode(image, fmt, options):
+    buf = io.BytesIO()
+    image.save(buf, format=fmt, **options)
+    return buf.getvalue()
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _write_atomic(path, body):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(body)
+    os.replace(tmp, path)
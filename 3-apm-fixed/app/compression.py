@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+import threading
+from collections import namedtuple
+
+from flask import Response, render_template, request
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+# Compressed responses.
+#
+# PageCache renders a template once and keeps its identity, gzip and brotli
+# encodings, so /, /settings and /qr-popup cost a dict lookup instead of a
+# Jinja render plus a 60 KB transfer. A template is rendered again only
+# when Jinja hands back a new Template object, i.e. when auto-reload sees
+# the file change (development) or after a restart (a new app version).
+#
+# init_app() also compresses JSON API responses on the fly.
+
+# Smaller bodies gain less than the Content-Encoding overhead
+MIN_COMPRESS_BYTES = 512
+GZIP_LEVEL = 6
+BROTLI_PAGE_QUALITY = 11    # pages are compressed once, spend the CPU
+BROTLI_DYNAMIC_QUALITY = 5  # per-response JSON compression
+
+CachedPage = namedtuple("CachedPage", "template etag bodies")
+
+
+def _compress(body, encoding, brotli_quality):
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate_encoding():
+    """Best content coding the client accepts, or None for identity."""
+    accepted = request.accept_encodings
+    best = None
+    for encoding in _encodings():
+        quality = accepted[encoding]
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+
+class PageCache:
+    def __init__(self):
+        self._pages = {}  # template name -> CachedPage
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        from flask import current_app
+
+        template = current_app.jinja_env.get_template(name)
+        page = self._pages.get(name)
+        if page is not None and page.template is template:
+            return page
+        body = render_template(template).encode()
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        bodies = {None: body}
+        for encoding in _encodings():
+            bodies[encoding] = _compress(body, encoding, BROTLI_PAGE_QUALITY)
+        page = CachedPage(template, digest, bodies)
+        with self._lock:
+            self._pages[name] = page
+        return page
+
+    def response(self, name):
+        """The cached page in the client's preferred encoding, 304 if unchanged."""
+        page = self.get(name)
+        encoding = negotiate_encoding()
+        response = Response(page.bodies[encoding], mimetype="text/html")
+        # One ETag per representation: the encodings differ byte for byte
+        response.set_etag(f"{page.etag}-{encoding}" if encoding else page.etag)
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add("Accept-Encoding")
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    def stats(self):
+        return {
+            name: {str(encoding or "identity"): len(body) for encoding, body in page.bodies.items()}
+            for name, page in self._pages.items()
+        }
+
+
+def compress_json_response(response):
+    """after_request hook: compress JSON bodies the client accepts compressed."""
+    if (response.status_code != 200 or response.mimetype != "application/json"
+            or response.direct_passthrough or response.content_encoding):
+        return response
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_BYTES:
+        return response
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    response.set_data(_compress(body, encoding, BROTLI_DYNAMIC_QUALITY))
+    response.content_encoding = encoding
+    # The compressed bytes differ, but they encode the same document:
+    # downgrade a strong ETag so conditional requests still match it
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_json_response)
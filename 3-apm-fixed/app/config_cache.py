@@ -0,0 +1,43 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+from threading import Lock
+
+# Parsed JSON config files, re-read only when the file's mtime or size
+# changes. Each entry also carries the serialized response body and its
+# ETag so API handlers can answer without touching json at all.
+
+CachedJSON = namedtuple("CachedJSON", "data body etag")
+
+
+class JSONFileCache:
+    def __init__(self, path, indent=None):
+        self.path = path
+        self.indent = indent
+        self._lock = Lock()
+        self._cached = (None, None)  # (stamp, CachedJSON), swapped atomically
+
+    def get(self):
+        """Return the current CachedJSON; raises OSError/ValueError like json.load."""
+        st = os.stat(self.path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached_stamp, entry = self._cached
+        if entry is not None and stamp == cached_stamp:
+            return entry
+        with self._lock:
+            cached_stamp, entry = self._cached
+            if entry is None or stamp != cached_stamp:
+                with open(self.path) as f:
+                    data = json.load(f)
+                if self.indent is None:
+                    body = json.dumps(data, separators=(",", ":")).encode()
+                else:
+                    body = json.dumps(data, indent=self.indent).encode()
+                entry = CachedJSON(data, body, hashlib.sha1(body).hexdigest())
+                self._cached = (stamp, entry)
+            return entry
+
+
+golden_standard_cache = JSONFileCache(os.path.join("config", "golden_standard.json"))
+config_cache = JSONFileCache(os.path.join("config", "config.json"), indent=2)
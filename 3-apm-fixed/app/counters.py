@@ -0,0 +1,403 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+# Scan counters for /done, /ping and /reset.
+#
+# MemoryCounterStore keeps counts in this process only (fine for `flask run`).
+# SharedCounterStore keeps them in an mmap'd file so every worker on the host
+# sees the same count. Select it by pointing DDTIMER_COUNTER_FILE at a path,
+# ideally on tmpfs (e.g. /dev/shm/ddtimer-counters).
+#
+# Both are bounded: sessions with no scan or reset for DDTIMER_SESSION_TTL
+# seconds are evicted, and when the store is full (DDTIMER_MAX_SESSIONS,
+# or the slot count of the shared file) the least recently changed session
+# makes room. Reading an unknown session never allocates, and a session
+# past its TTL reads as unknown even before a write gets round to evicting it.
+#
+# incr_once() counts a scan only the first time a device token is seen for
+# the session. Seen tokens go into a fixed-size Bloom filter per session
+# (DEDUP_BLOOM_BYTES), cleared by reset(): the check is O(1) and memory is
+# bounded however many devices scan. A false positive drops a genuine first
+# scan; with 4096 bits and 4 hashes that is ~0.01% of devices at 100 per
+# session and ~2% at 500. The filters live only in memory (or the shared
+# file): counts restored from the database after a restart start with an
+# empty filter, so a device that already scanned is counted once more.
+
+COUNTER_FILE_ENV = "DDTIMER_COUNTER_FILE"
+COUNTER_SLOTS_ENV = "DDTIMER_COUNTER_SLOTS"
+DEFAULT_SLOTS = 4096
+MAX_SESSIONS = int(os.environ.get("DDTIMER_MAX_SESSIONS", 10000))
+SESSION_TTL = float(os.environ.get("DDTIMER_SESSION_TTL", 172800))
+SWEEP_INTERVAL = 60  # seconds between TTL sweeps of the shared table
+DEDUP_BLOOM_BYTES = 512
+DEDUP_HASHES = 4
+
+
+def _token_bits(token):
+    """Bloom filter bit positions of a device token."""
+    digest = hashlib.blake2b(token.encode(), digest_size=4 * DEDUP_HASHES).digest()
+    return [n % (DEDUP_BLOOM_BYTES * 8) for n in struct.unpack(f"<{DEDUP_HASHES}I", digest)]
+
+
+def _bloom_add(bloom, bits):
+    """Set bits in bloom (a writable buffer); False if all were already set."""
+    added = False
+    for bit in bits:
+        mask = 1 << (bit & 7)
+        if not bloom[bit >> 3] & mask:
+            bloom[bit >> 3] |= mask
+            added = True
+    return added
+
+
+class MemoryCounterStore:
+    # In-process waiters are woken directly, no need to re-check the store
+    poll_interval = None
+
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = Lock()
+        # session_id -> [count, last_ping (epoch seconds), seen-token Bloom
+        # filter or None], oldest change first
+        self._counts = OrderedDict()
+
+    def _touch(self, session_id, now):
+        """Entry for session_id moved to the newest end; evicts as needed. Lock held."""
+        entry = self._counts.get(session_id)
+        if entry is None:
+            entry = self._counts[session_id] = [0, now, None]
+        else:
+            self._counts.move_to_end(session_id)
+        self._expire(now)
+        return entry
+
+    def _expire(self, now):
+        cutoff = now - self.ttl
+        while self._counts:
+            oldest = next(iter(self._counts.values()))
+            if oldest[1] >= cutoff and len(self._counts) <= self.max_sessions:
+                break
+            self._counts.popitem(last=False)
+            self.evictions += 1
+
+    def incr(self, session_id):
+        now = time.time()
+        with self._lock:
+            entry = self._touch(session_id, now)
+            entry[0] += 1
+            entry[1] = now
+            return entry[0]
+
+    def incr_once(self, session_id, token):
+        """(count, counted): counts the scan unless token was already seen."""
+        bits = _token_bits(token)
+        now = time.time()
+        with self._lock:
+            # An expired session's seen tokens must not swallow this scan
+            self._expire(now)
+            entry = self._counts.get(session_id)
+            if entry is not None and entry[2] is not None and not _bloom_add(entry[2], bits):
+                return entry[0], False
+            entry = self._touch(session_id, now)
+            if entry[2] is None:
+                entry[2] = bytearray(DEDUP_BLOOM_BYTES)
+                _bloom_add(entry[2], bits)
+            entry[0] += 1
+            entry[1] = now
+            return entry[0], True
+
+    def _live(self, session_id):
+        """Entry for session_id, or None when unknown or past its TTL (then evicted)."""
+        entry = self._counts.get(session_id)
+        if entry is None:
+            return None
+        now = time.time()
+        if entry[1] >= now - self.ttl:
+            return entry
+        with self._lock:
+            self._expire(now)
+        return None
+
+    def get(self, session_id):
+        entry = self._live(session_id)
+        return entry[0] if entry else 0
+
+    def last_ping(self, session_id):
+        entry = self._live(session_id)
+        return datetime.fromtimestamp(entry[1]) if entry else None
+
+    def reset(self, session_id):
+        now = time.time()
+        with self._lock:
+            entry = self._touch(session_id, now)
+            entry[0] = 0
+            entry[1] = now
+            entry[2] = None
+
+    def snapshot(self, session_id):
+        """(count, last change as epoch seconds), or None for unknown sessions."""
+        entry = self._live(session_id)
+        return (entry[0], entry[1]) if entry else None
+
+    def restore(self, session_id, count, changed_at):
+        """Seed a persisted count unless this session already has one.
+
+        Call in changed_at order so the oldest sessions are evicted first.
+        The dedup filter isn't persisted, so it starts empty.
+        """
+        now = time.time()
+        if changed_at < now - self.ttl:
+            return
+        with self._lock:
+            if session_id not in self._counts:
+                self._counts[session_id] = [count, changed_at, None]
+                self._expire(now)
+
+    def stats(self):
+        return {
+            "sessions": len(self._counts),
+            "max_sessions": self.max_sessions,
+            "ttl": self.ttl,
+            "evictions": self.evictions,
+        }
+
+
+class SharedCounterStore:
+    """Fixed-slot open-addressing table in a shared mmap.
+
+    Slot layout: session key hash (u64, 0 = empty), count (i64), last_ping (f64),
+    then the session's seen-token Bloom filter (DEDUP_BLOOM_BYTES).
+    Reads are lock-free; writes take a thread lock plus an fcntl byte-range
+    lock on the touched slot only, so workers contend per session, not globally.
+    Evicted slots become tombstones: probes continue past them and inserts
+    reuse them.
+    """
+
+    MAGIC = b"DDTCNT02"
+    HEADER = struct.Struct("<8sQ")  # magic, slot count
+    SLOT = struct.Struct("<Qqd")
+    SLOT_SIZE = SLOT.size + DEDUP_BLOOM_BYTES
+    TOMBSTONE = 0xFFFFFFFFFFFFFFFF
+
+    # Other workers can't wake our waiters, so streams re-check the table
+    poll_interval = 0.25
+
+    def __init__(self, path, slots=DEFAULT_SLOTS, ttl=SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.evictions = 0  # by this process
+        size = self.HEADER.size + slots * self.SLOT_SIZE
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self.HEADER.size, 0)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, self.HEADER.pack(self.MAGIC, slots), 0)
+            magic, slots = self.HEADER.unpack(os.pread(self._fd, self.HEADER.size, 0))
+            if magic != self.MAGIC:
+                raise ValueError(f"{path} is not a ddtimer counter file of this version; remove it")
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.HEADER.size, 0)
+        self.slots = slots
+        self._map = mmap.mmap(self._fd, self.HEADER.size + slots * self.SLOT_SIZE)
+        self._lock = Lock()
+        self._last_sweep = time.monotonic()
+
+    @classmethod
+    def _key(cls, session_id):
+        key = int.from_bytes(
+            hashlib.blake2b(session_id.encode(), digest_size=8).digest(), "little"
+        )
+        return key if key not in (0, cls.TOMBSTONE) else 1
+
+    def _offset(self, index):
+        return self.HEADER.size + index * self.SLOT_SIZE
+
+    def _slot_key(self, offset):
+        return struct.unpack_from("<Q", self._map, offset)[0]
+
+    def _find(self, key):
+        """Offset of the slot holding key, or None. Lock-free."""
+        start = key % self.slots
+        for i in range(self.slots):
+            offset = self._offset((start + i) % self.slots)
+            slot_key = self._slot_key(offset)
+            if slot_key == key:
+                return offset
+            if slot_key == 0:
+                return None
+        return None
+
+    def _probe(self, key):
+        """Offset holding key, else the first free slot on its chain, else None."""
+        start = key % self.slots
+        free = None
+        for i in range(self.slots):
+            offset = self._offset((start + i) % self.slots)
+            slot_key = self._slot_key(offset)
+            if slot_key == key:
+                return offset
+            if slot_key == self.TOMBSTONE and free is None:
+                free = offset
+            elif slot_key == 0:
+                return offset if free is None else free
+        return free
+
+    def _bloom(self, offset):
+        start = offset + self.SLOT.size
+        return memoryview(self._map)[start:start + DEDUP_BLOOM_BYTES]
+
+    def _update(self, session_id, fn, changed_at=None):
+        """Set the slot to fn(count, exists, bloom) and return it; fn returns None to leave it.
+
+        bloom is the slot's seen-token filter, writable while fn runs.
+        """
+        key = self._key(session_id)
+        with self._lock:
+            if time.monotonic() - self._last_sweep > SWEEP_INTERVAL:
+                self._expire()
+            while True:
+                offset = self._probe(key)
+                if offset is None:
+                    if not self._evict_oldest():
+                        raise RuntimeError(f"counter table {self.path} is full ({self.slots} slots)")
+                    continue
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, self.SLOT_SIZE, offset)
+                bloom = self._bloom(offset)
+                try:
+                    slot_key, count, last = self.SLOT.unpack_from(self._map, offset)
+                    exists = slot_key == key
+                    if not exists:
+                        # Another worker may have claimed this slot, or inserted
+                        # the key elsewhere, since the probe
+                        if slot_key not in (0, self.TOMBSTONE) or self._find(key) is not None:
+                            continue
+                    if not exists or last < time.time() - self.ttl:
+                        # New, or expired but not swept yet: start over
+                        exists = False
+                        count = 0
+                        # A reused slot may hold the evicted session's tokens
+                        bloom[:] = bytes(DEDUP_BLOOM_BYTES)
+                    new_count = fn(count, exists, bloom)
+                    if new_count is None:
+                        return count
+                    self.SLOT.pack_into(self._map, offset, key, new_count,
+                                        time.time() if changed_at is None else changed_at)
+                    return new_count
+                finally:
+                    bloom.release()
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, self.SLOT_SIZE, offset)
+
+    def _evict_slot(self, offset, predicate):
+        """Tombstone the slot if predicate(key, last_ping) holds under its lock."""
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self.SLOT_SIZE, offset)
+        try:
+            slot_key, count, last = self.SLOT.unpack_from(self._map, offset)
+            if slot_key in (0, self.TOMBSTONE) or not predicate(slot_key, last):
+                return False
+            self.SLOT.pack_into(self._map, offset, self.TOMBSTONE, 0, 0.0)
+            self.evictions += 1
+            return True
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.SLOT_SIZE, offset)
+
+    def _expire(self):
+        """Tombstone sessions idle longer than the TTL. Thread lock held."""
+        self._last_sweep = time.monotonic()
+        cutoff = time.time() - self.ttl
+        for index in range(self.slots):
+            offset = self._offset(index)
+            slot_key, count, last = self.SLOT.unpack_from(self._map, offset)
+            if slot_key not in (0, self.TOMBSTONE) and last < cutoff:
+                self._evict_slot(offset, lambda key, last: last < cutoff)
+
+    def _evict_oldest(self):
+        """Make room in a full table by evicting its least recently changed session."""
+        oldest = None
+        for index in range(self.slots):
+            offset = self._offset(index)
+            slot_key, count, last = self.SLOT.unpack_from(self._map, offset)
+            if slot_key not in (0, self.TOMBSTONE) and (oldest is None or last < oldest[2]):
+                oldest = (offset, slot_key, last)
+        if oldest is None:
+            return False
+        offset, victim, _ = oldest
+        self._evict_slot(offset, lambda key, last: key == victim)
+        return True
+
+    def stats(self):
+        live = 0
+        for index in range(self.slots):
+            if self._slot_key(self._offset(index)) not in (0, self.TOMBSTONE):
+                live += 1
+        return {
+            "sessions": live,
+            "max_sessions": self.slots,
+            "ttl": self.ttl,
+            "evictions": self.evictions,
+        }
+
+    def incr(self, session_id):
+        return self._update(session_id, lambda count, exists, bloom: count + 1)
+
+    def incr_once(self, session_id, token):
+        """(count, counted): counts the scan unless token was already seen."""
+        bits = _token_bits(token)
+        counted = False
+
+        def add(count, exists, bloom):
+            nonlocal counted
+            if not _bloom_add(bloom, bits):
+                return None
+            counted = True
+            return count + 1
+
+        return self._update(session_id, add), counted
+
+    def reset(self, session_id):
+        def clear(count, exists, bloom):
+            bloom[:] = bytes(DEDUP_BLOOM_BYTES)
+            return 0
+
+        self._update(session_id, clear)
+
+    def _live(self, session_id):
+        """(count, last_ping) of session_id, or None when unknown or past its TTL."""
+        offset = self._find(self._key(session_id))
+        if offset is None:
+            return None
+        count, last = self.SLOT.unpack_from(self._map, offset)[1:]
+        # Swept on the next write after SWEEP_INTERVAL; reads don't wait for it
+        return (count, last) if last >= time.time() - self.ttl else None
+
+    def snapshot(self, session_id):
+        """(count, last change as epoch seconds), or None for unknown sessions."""
+        return self._live(session_id)
+
+    def restore(self, session_id, count, changed_at):
+        """Seed a persisted count (with an empty dedup filter) unless this session already has one."""
+        self._update(session_id, lambda current, exists, bloom: None if exists else count, changed_at)
+
+    def get(self, session_id):
+        entry = self._live(session_id)
+        return entry[0] if entry else 0
+
+    def last_ping(self, session_id):
+        entry = self._live(session_id)
+        return datetime.fromtimestamp(entry[1]) if entry else None
+
+
+def create_counter_store():
+    path = os.environ.get(COUNTER_FILE_ENV)
+    if not path:
+        return MemoryCounterStore()
+    return SharedCounterStore(path, int(os.environ.get(COUNTER_SLOTS_ENV, DEFAULT_SLOTS)), SESSION_TTL)
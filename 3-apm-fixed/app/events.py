@@ -0,0 +1,139 @@
+import time
+from contextlib import contextmanager
+from threading import Condition, Lock
+
+
+class SessionNotifier:
+    """Per-session wake-ups for long-poll and streaming clients.
+
+    A Condition is only allocated while at least one client is waiting on a
+    session, so /done and /reset on a session nobody watches cost a dict lookup.
+    """
+
+    def __init__(self, poll_interval=None):
+        # When state can change in another process, waiters also re-check
+        # their predicate every poll_interval seconds.
+        self.poll_interval = poll_interval
+        self._lock = Lock()
+        self._waiters = {}  # session_id -> [Condition, number of waiters]
+
+    @contextmanager
+    def watching(self, session_id):
+        with self._lock:
+            entry = self._waiters.get(session_id)
+            if entry is None:
+                entry = self._waiters[session_id] = [Condition(), 0]
+            entry[1] += 1
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._waiters[session_id]
+
+    def notify(self, session_id):
+        with self._lock:
+            entry = self._waiters.get(session_id)
+        if entry is not None:
+            with entry[0]:
+                entry[0].notify_all()
+
+    def wait_for(self, session_id, predicate, timeout):
+        """Block until predicate() is true or timeout expires; returns predicate()."""
+        with self.watching(session_id) as cond:
+            with cond:
+                if self.poll_interval is None:
+                    return cond.wait_for(predicate, timeout)
+                deadline = time.monotonic() + timeout
+                while not predicate():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    cond.wait(min(remaining, self.poll_interval))
+                return True
+
+
+class StateWatch:
+    """One streaming client's view of a session's state changes."""
+
+    def __init__(self, callback=None):
+        # callback() runs on the publishing thread; async servers use it to
+        # wake their event loop instead of blocking in wait()
+        self._callback = callback
+        self._cond = Condition()
+        self._pending = False
+        self._version = None
+        self._unknown = False
+
+    def changed(self, version):
+        with self._cond:
+            self._pending = True
+            if version is None:
+                self._unknown = True
+            elif self._version is None or version > self._version:
+                self._version = version
+            self._cond.notify_all()
+        if self._callback is not None:
+            self._callback()
+
+    @property
+    def pending(self):
+        """True while a change hasn't been take()n yet."""
+        with self._cond:
+            return self._pending
+
+    def wait(self, timeout):
+        """True once a change is pending, False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending, timeout)
+
+    def take(self):
+        """Latest published version since the last take(), None when unknown."""
+        with self._cond:
+            version = None if self._unknown else self._version
+            self._pending = False
+            self._version = None
+            self._unknown = False
+            return version
+
+
+class StateChangeFeed:
+    """Fan-out of session state changes to this process's streaming clients.
+
+    Stores publish their own commits; with Postgres, other workers' commits
+    arrive through the state cache's LISTEN connection. Publishing to a
+    session nobody watches costs a dict lookup.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._watches = {}  # session_id -> set of StateWatch
+
+    @contextmanager
+    def watch(self, session_id, callback=None):
+        watch = StateWatch(callback)
+        with self._lock:
+            self._watches.setdefault(session_id, set()).add(watch)
+        try:
+            yield watch
+        finally:
+            with self._lock:
+                watches = self._watches[session_id]
+                watches.discard(watch)
+                if not watches:
+                    del self._watches[session_id]
+
+    def publish(self, session_id, version=None):
+        """session_id None: every session may have changed (bulk import, lost listener)."""
+        with self._lock:
+            if session_id is None:
+                watches = [w for ws in self._watches.values() for w in ws]
+            else:
+                watches = list(self._watches.get(session_id, ()))
+        for watch in watches:
+            watch.changed(version)
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._watches), "clients": sum(len(ws) for ws in self._watches.values())}
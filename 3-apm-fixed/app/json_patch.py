@@ -0,0 +1,203 @@
+import copy
+import json
+import re
+
+# Partial updates of session state documents.
+#
+# Supports JSON Merge Patch (RFC 7386) and the add/replace/remove/test
+# operations of JSON Patch (RFC 6902). Each patch can be applied in Python
+# or compiled into one JSONB expression over the `state` column (plus the
+# conditions the row must meet), so Postgres applies it in the UPDATE
+# itself. `add` is supported for object members only; move/copy and
+# appending with "-" are not. Array indices must be canonical ("0", "12"),
+# so "-1" or "01" are rejected rather than read differently by Postgres.
+
+MERGE_PATCH = "application/merge-patch+json"
+JSON_PATCH = "application/json-patch+json"
+JSON_PATCH_OPS = ("add", "replace", "remove", "test")
+
+ARRAY_INDEX = re.compile(r"0|[1-9][0-9]*")
+# Tokens Postgres would still read as an index ("-1" counts from the end)
+LOOSE_INDEX = re.compile(r"\s*[+-]?[0-9]+\s*")
+
+
+class PatchError(ValueError):
+    """The patch document itself is invalid (400)."""
+
+
+class PatchConflict(PatchError):
+    """The patch is valid but can't be applied to this document (409)."""
+
+
+def validate_patch(patch, merge):
+    """PatchError unless patch is a merge patch object (merge) or a valid JSON Patch.
+
+    Stores call this before looking at the stored document, so a malformed
+    patch is a 400 on every backend.
+    """
+    if merge:
+        if not isinstance(patch, dict):
+            raise PatchError("A merge patch for a session state must be an object")
+    else:
+        validate_json_patch(patch)
+
+
+# --- Python ---
+
+def apply_merge_patch(target, patch):
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+
+def parse_pointer(pointer):
+    """JSON Pointer (RFC 6901) -> list of reference tokens."""
+    if pointer == "":
+        return []
+    if not isinstance(pointer, str) or not pointer.startswith("/"):
+        raise PatchError(f"Invalid JSON pointer: {pointer!r}")
+    tokens = [t.replace("~1", "/").replace("~0", "~") for t in pointer[1:].split("/")]
+    if "-" in tokens:
+        raise PatchError("Appending to arrays with '-' is not supported")
+    for token in tokens:
+        if LOOSE_INDEX.fullmatch(token) and not ARRAY_INDEX.fullmatch(token):
+            raise PatchError(f"Invalid array index {token!r} in {pointer!r}")
+    return tokens
+
+
+def validate_json_patch(operations):
+    """[(op, tokens, value)] for a JSON Patch document, or PatchError."""
+    if not isinstance(operations, list):
+        raise PatchError("A JSON Patch must be an array of operations")
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get("op") not in JSON_PATCH_OPS:
+            raise PatchError(f"Unsupported operation: {operation!r}; use one of {', '.join(JSON_PATCH_OPS)}")
+        op = operation["op"]
+        if op != "remove" and "value" not in operation:
+            raise PatchError(f"'{op}' needs a value")
+        tokens = parse_pointer(operation.get("path"))
+        if not tokens and op == "remove":
+            raise PatchError("Can't remove the whole document")
+        parsed.append((op, tokens, operation.get("value")))
+    return parsed
+
+
+def _resolve(doc, tokens):
+    for token in tokens:
+        if isinstance(doc, dict) and token in doc:
+            doc = doc[token]
+        elif isinstance(doc, list) and ARRAY_INDEX.fullmatch(token) and int(token) < len(doc):
+            doc = doc[int(token)]
+        else:
+            raise PatchConflict(f"Path /{'/'.join(tokens)} does not exist")
+    return doc
+
+
+def apply_json_patch(doc, operations):
+    doc = copy.deepcopy(doc)
+    for op, tokens, value in validate_json_patch(operations):
+        if op == "test":
+            if _resolve(doc, tokens) != value:
+                raise PatchConflict(f"Test failed at /{'/'.join(tokens)}")
+            continue
+        if not tokens:
+            doc = copy.deepcopy(value)
+            continue
+        parent, key = _resolve(doc, tokens[:-1]), tokens[-1]
+        if op == "add":
+            if not isinstance(parent, dict):
+                raise PatchConflict(f"'add' into /{'/'.join(tokens[:-1])} needs an object")
+            parent[key] = copy.deepcopy(value)
+            continue
+        _resolve(doc, tokens)
+        if isinstance(parent, list):
+            key = int(key)
+        if op == "replace":
+            parent[key] = copy.deepcopy(value)
+        else:
+            del parent[key]
+    return doc
+
+
+# --- Postgres JSONB ---
+
+class _SQL:
+    def __init__(self):
+        self.params = {}
+
+    def bind(self, value, cast):
+        name = f"patch_{len(self.params)}"
+        self.params[name] = value
+        return f"CAST(:{name} AS {cast})"
+
+    def jsonb(self, value):
+        return self.bind(json.dumps(value), "jsonb")
+
+    def path(self, tokens):
+        return self.bind(list(tokens), "text[]")
+
+
+def merge_patch_sql(patch):
+    """(expression, params) computing `state` with patch merged in."""
+    validate_patch(patch, merge=True)
+    sql = _SQL()
+    return _merge_expression(sql, "state", patch), sql.params
+
+
+def _merge_expression(sql, target, patch):
+    expression = target
+    scalars = {k: v for k, v in patch.items() if v is not None and not isinstance(v, dict)}
+    removed = [k for k, v in patch.items() if v is None]
+    if scalars:
+        expression = f"({expression} || {sql.jsonb(scalars)})"
+    if removed:
+        expression = f"({expression} - {sql.bind(removed, 'text[]')})"
+    for key, value in patch.items():
+        if isinstance(value, dict):
+            key_param = sql.bind(key, "text")
+            # RFC 7386: merging into a non-object member starts from {}
+            member = (f"(CASE WHEN jsonb_typeof({target} -> {key_param}) = 'object' "
+                      f"THEN {target} -> {key_param} ELSE '{{}}'::jsonb END)")
+            merged = _merge_expression(sql, member, value)
+            expression = f"jsonb_set({expression}, {sql.path([key])}, {merged}, true)"
+    return expression
+
+
+def json_patch_sql(operations):
+    """(expression, conditions, params) applying a JSON Patch to `state`.
+
+    conditions are SQL booleans that must all hold for the patch to apply;
+    when one fails the UPDATE matches no row.
+    """
+    sql = _SQL()
+    expression = "state"
+    conditions = []
+    replaces_root = False
+    for op, tokens, value in validate_json_patch(operations):
+        if op == "test":
+            conditions.append(f"({expression} #> {sql.path(tokens)}) = {sql.jsonb(value)}")
+            continue
+        if not tokens:
+            expression = sql.jsonb(value)
+            replaces_root = True
+            continue
+        if op == "add":
+            parent = f"({expression} #> {sql.path(tokens[:-1])})"
+            conditions.append(f"jsonb_typeof({parent}) = 'object'")
+            expression = f"jsonb_set({expression}, {sql.path(tokens)}, {sql.jsonb(value)}, true)"
+            continue
+        conditions.append(f"({expression} #> {sql.path(tokens)}) IS NOT NULL")
+        if op == "replace":
+            expression = f"jsonb_set({expression}, {sql.path(tokens)}, {sql.jsonb(value)}, false)"
+        else:
+            expression = f"({expression} #- {sql.path(tokens)})"
+    if replaces_root:
+        conditions.append(f"jsonb_typeof({expression}) = 'object'")
+    return expression, conditions, sql.params
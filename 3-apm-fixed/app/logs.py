@@ -0,0 +1,150 @@
+import atexit
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+# JSON logging that stays off the request thread.
+#
+# Request threads only put records on a queue; a listener thread per process
+# formats them as JSON and writes them out. Access-log lines for chatty
+# endpoints are sampled before they are even queued, per
+# DDTIMER_ACCESS_LOG_SAMPLE="<path prefix>=<rate>,..." (rate 0 suppresses,
+# 1 keeps everything). Error responses (status >= 400) are always logged.
+
+DEFAULT_ACCESS_LOG_SAMPLE = "/ping=0.01"
+ACCESS_LOGGERS = ("werkzeug", "gunicorn.access", "uvicorn.access")
+# Attributes ddtrace adds to records when DD_LOGS_INJECTION=true
+DD_ATTRIBUTES = ("dd.trace_id", "dd.span_id", "dd.service", "dd.env", "dd.version")
+
+# C string escaper from the json module; the rest of each line is fixed text
+_quote = json.encoder.encode_basestring_ascii
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, with Datadog trace correlation fields."""
+
+    def __init__(self):
+        super().__init__()
+        self._second = None
+        self._second_text = ""
+
+    def _timestamp(self, created):
+        second = int(created)
+        if second != self._second:
+            # Formatted once per second; only the fraction changes in between
+            self._second_text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+            self._second = second
+        return f"{self._second_text}.{int((created - second) * 1e6):06d}Z"
+
+    def format(self, record):
+        parts = [
+            '{"timestamp":"', self._timestamp(record.created),
+            '","level":"', record.levelname,
+            '","logger":', _quote(record.name),
+            ',"message":', _quote(record.getMessage()),
+        ]
+        attributes = record.__dict__
+        for name in DD_ATTRIBUTES:
+            value = attributes.get(name)
+            if value is not None:
+                # ddtrace 2.x uses 128-bit trace IDs as hex strings - pass as-is
+                parts += [',"', name, '":', _quote(str(value))]
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            parts += [',"error.stack":', _quote(record.exc_text)]
+        parts.append("}")
+        return "".join(parts)
+
+
+class _RecordQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # The queue never leaves this process, so unlike the stdlib handler
+        # this neither copies the record nor formats it: merging the args now
+        # is enough to keep later mutation of them out of the log line
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class AccessLogSampler(logging.Filter):
+    """Keep a fraction of access-log lines for matching paths."""
+
+    REQUEST = re.compile(r'"[A-Z]+ ([^ ?"]+)[^"]*" (\d{3})')
+
+    def __init__(self, rules):
+        super().__init__()
+        # Longest prefix first, so "/ping/stream" can override "/ping"
+        self.rules = sorted(rules.items(), key=lambda rule: -len(rule[0]))
+        self.dropped = 0
+
+    @classmethod
+    def from_env(cls, value=None):
+        if value is None:
+            value = os.environ.get("DDTIMER_ACCESS_LOG_SAMPLE", DEFAULT_ACCESS_LOG_SAMPLE)
+        rules = {}
+        for item in value.split(","):
+            prefix, _, rate = item.strip().partition("=")
+            if prefix:
+                rules[prefix] = float(rate or 0)
+        return cls(rules)
+
+    def filter(self, record):
+        if not self.rules:
+            return True
+        match = self.REQUEST.search(record.getMessage())
+        if match is None or int(match.group(2)) >= 400:
+            return True
+        path = match.group(1)
+        for prefix, rate in self.rules:
+            if path.startswith(prefix):
+                if rate >= 1 or (rate > 0 and random.random() < rate):
+                    return True
+                self.dropped += 1
+                return False
+        return True
+
+
+class LogPipeline:
+    def __init__(self, stream=None):
+        self.output = logging.StreamHandler(stream or sys.stderr)
+        self.output.setFormatter(JSONFormatter())
+        self.handler = _RecordQueueHandler(SimpleQueue())
+        self.sampler = AccessLogSampler.from_env()
+        self.listener = None
+
+    def start(self):
+        """Start the writer thread; forked children get a fresh queue and thread."""
+        self.handler.queue = SimpleQueue()
+        self.listener = QueueListener(self.handler.queue, self.output, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+
+
+def configure_logging(level=logging.INFO, stream=None):
+    pipeline = LogPipeline(stream)
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    root_logger.handlers = [pipeline.handler]
+    for name in ACCESS_LOGGERS:
+        access_logger = logging.getLogger(name)
+        access_logger.addFilter(pipeline.sampler)
+        if name != "werkzeug":
+            # Send gunicorn's and uvicorn's access lines through the queue
+            # too, instead of their own plain-text handlers
+            access_logger.handlers = [pipeline.handler]
+            access_logger.propagate = False
+    logging.getLogger("werkzeug").setLevel(level)
+    pipeline.start()
+    os.register_at_fork(after_in_child=pipeline.start)
+    atexit.register(pipeline.stop)
+    return pipeline
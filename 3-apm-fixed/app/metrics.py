@@ -0,0 +1,215 @@
+import fcntl
+import functools
+import glob
+import hashlib
+import mmap
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager, suppress
+
+# In-app latency histograms and counters, exposed as Prometheus text on
+# /metrics without needing the Datadog agent.
+#
+# Every process writes its own fixed-layout array of doubles. With
+# DDTIMER_METRICS_DIR set (gunicorn sets it when running several workers)
+# the array lives in <dir>/metrics-<pid>.db and /metrics sums the files of
+# all workers; otherwise it is process memory. When a worker exits,
+# gunicorn's child_exit hook folds its file into metrics-dead.db and removes
+# it, so counts stay cumulative and a new worker reusing the PID starts
+# from an empty file. Recording takes a lock and a few float additions.
+
+METRICS_DIR_ENV = "DDTIMER_METRICS_DIR"
+PREFIX = "ddtimer"
+# Seconds; /ping long-polls can legitimately take up to PING_MAX_WAIT
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+OPERATIONS = (
+    "session_state_get",
+    "session_state_get_many",
+    "session_state_set",
+    "session_state_patch",
+    "qr_render",
+    "golden_standard_load",
+    "done",
+    "ping",
+    "ping_wait",
+    "db_pool_wait",
+)
+COUNTERS = {
+    "scans_total": "Scans recorded by /done",
+    "duplicate_scans_total": "Repeat /done scans from a device already counted for the session",
+    "resets_total": "Scan count resets",
+    "db_pool_timeouts_total": "Database connection checkouts that timed out waiting for the pool",
+}
+MAGIC = b"DDTMET01"
+DEAD_FILE = "metrics-dead.db"
+
+
+class Metrics:
+    def __init__(self, operations=OPERATIONS, counters=COUNTERS, buckets=LATENCY_BUCKETS, directory=None):
+        self.operations = operations
+        self.counters = counters
+        self.buckets = buckets
+        self.directory = directory if directory is not None else os.environ.get(METRICS_DIR_ENV)
+        # Per operation: one slot per bucket plus +Inf, then sum and count
+        self._stride = len(buckets) + 3
+        self._op_offsets = {op: i * self._stride for i, op in enumerate(operations)}
+        base = len(operations) * self._stride
+        self._counter_offsets = {name: base + i for i, name in enumerate(counters)}
+        self.size = base + len(counters)
+        layout = repr((operations, tuple(counters), buckets)).encode()
+        # Files written by a different layout (an older deploy) are ignored
+        self._header = MAGIC + hashlib.blake2b(layout, digest_size=8).digest()
+        self._lock = threading.Lock()
+        self._values = None
+        self._pid = None
+
+    def _array(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._values = self._allocate()
+                    self._pid = os.getpid()
+        return self._values
+
+    def _allocate(self):
+        nbytes = len(self._header) + self.size * 8
+        if not self.directory:
+            buf = bytearray(nbytes)
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"metrics-{os.getpid()}.db")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                os.ftruncate(fd, nbytes)
+                buf = mmap.mmap(fd, nbytes)
+            finally:
+                os.close(fd)
+            if buf[:len(self._header)] != self._header:
+                # New file, or one left by another layout
+                buf[:] = bytes(nbytes)
+        buf[:len(self._header)] = self._header
+        return memoryview(buf)[len(self._header):].cast("d")
+
+    def observe(self, operation, seconds):
+        values = self._array()
+        offset = self._op_offsets[operation]
+        bucket = bisect_left(self.buckets, seconds)
+        with self._lock:
+            values[offset + bucket] += 1
+            values[offset + self._stride - 2] += seconds
+            values[offset + self._stride - 1] += 1
+
+    def incr(self, name, amount=1):
+        values = self._array()
+        with self._lock:
+            values[self._counter_offsets[name]] += amount
+
+    @contextmanager
+    def timer(self, operation):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(operation, time.perf_counter() - start)
+
+    def timed(self, operation):
+        """Decorator recording each call's duration under `operation`."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(operation, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def _directory_lock(self, operation):
+        """flock on <dir>/.lock: shared for reading, exclusive while merging."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "a") as f:
+            fcntl.flock(f, operation)
+            yield
+
+    def _read(self, path):
+        """A file's values, or None if it's missing or has another layout."""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if not data.startswith(self._header) or len(data) != len(self._header) + self.size * 8:
+            return None
+        return memoryview(data)[len(self._header):].cast("d")
+
+    def totals(self):
+        """Values summed over every worker's file (or this process)."""
+        if not self.directory:
+            return list(self._array())
+        totals = [0.0] * self.size
+        with self._directory_lock(fcntl.LOCK_SH):
+            for path in glob.glob(os.path.join(self.directory, "metrics-*.db")):
+                values = self._read(path)
+                if values is None:
+                    continue
+                for i, value in enumerate(values):
+                    totals[i] += value
+        return totals
+
+    def mark_process_dead(self, pid):
+        """Fold an exited worker's file into metrics-dead.db and remove it."""
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"metrics-{pid}.db")
+        dead_path = os.path.join(self.directory, DEAD_FILE)
+        with self._directory_lock(fcntl.LOCK_EX):
+            values = self._read(path)
+            if values is not None:
+                merged = array("d", self._read(dead_path) or bytes(self.size * 8))
+                for i, value in enumerate(values):
+                    merged[i] += value
+                with open(dead_path + ".tmp", "wb") as f:
+                    f.write(self._header + merged.tobytes())
+                os.replace(dead_path + ".tmp", dead_path)
+            with suppress(FileNotFoundError):
+                os.unlink(path)
+
+    def render(self):
+        """Prometheus text exposition format (0.0.4)."""
+        totals = self.totals()
+        name = f"{PREFIX}_operation_duration_seconds"
+        lines = [
+            f"# HELP {name} Latency of instrumented operations.",
+            f"# TYPE {name} histogram",
+        ]
+        for op, offset in self._op_offsets.items():
+            cumulative = 0
+            for i, bound in enumerate(self.buckets + ("+Inf",)):
+                cumulative += totals[offset + i]
+                lines.append(f'{name}_bucket{{operation="{op}",le="{bound}"}} {cumulative:.0f}')
+            lines.append(f'{name}_sum{{operation="{op}"}} {totals[offset + self._stride - 2]!r}')
+            lines.append(f'{name}_count{{operation="{op}"}} {totals[offset + self._stride - 1]:.0f}')
+        for counter, offset in self._counter_offsets.items():
+            lines += [
+                f"# HELP {PREFIX}_{counter} {self.counters[counter]}.",
+                f"# TYPE {PREFIX}_{counter} counter",
+                f"{PREFIX}_{counter} {totals[offset]:.0f}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+# Shared by routes and the connection pool
+metrics = Metrics()
+
+
+def clear_directory(directory=None):
+    """Drop per-worker (and merged dead-worker) files from a previous server run."""
+    directory = directory if directory is not None else os.environ.get(METRICS_DIR_ENV)
+    if directory:
+        for path in glob.glob(os.path.join(directory, "metrics-*.db")):
+            os.unlink(path)
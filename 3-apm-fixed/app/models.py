@@ -5,4 +5,16 @@ class SessionState(db.Model):
     __tablename__ = 'session_states'
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String, unique=True, nullable=False)
-    state = db.Column(JSONB, nullable=False)
\ No newline at end of file
+    # JSONB on Postgres; plain JSON lets SQLite stand in for benchmarks
+    state = db.Column(db.JSON().with_variant(JSONB, 'postgresql'), nullable=False)
+    # Bumped on every write; exposed to clients as the ETag of the document
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+
+class SessionCount(db.Model):
+    __tablename__ = 'session_counts'
+    session_id = db.Column(db.String, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    # Epoch seconds of the counter change this row reflects; a late flush
+    # from another worker never overwrites a newer value
+    changed_at = db.Column(db.Float, nullable=False)
\ No newline at end of file
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+from .metrics import metrics
+
+# Database connection pool settings and checkout statistics.
+#
+# Engine options come from DDTIMER_DB_* environment variables (see
+# engine_options). The pool is a QueuePool that also times how long each
+# checkout waited, so /api/stats and /metrics can tell time spent waiting
+# for a free connection apart from time spent in Postgres.
+
+
+def _env(name, default, type=int):
+    value = os.environ.get(name)
+    return default if value in (None, "") else type(value)
+
+
+def _flag(value):
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def default_pool_size(production, max_overflow):
+    """Pool size per worker that keeps all workers within the connection budget.
+
+    A production worker wants one pooled connection per request thread, but
+    WEB_CONCURRENCY workers each also open up to max_overflow extra
+    connections and one LISTEN connection (app/state_cache.py), and together
+    they must stay under DDTIMER_DB_MAX_CONNECTIONS.
+    """
+    if not production:
+        return 5
+    threads = _env("DDTIMER_THREADS", 8)
+    workers = max(_env("DDTIMER_WORKERS", 1), 1)
+    budget = _env("DDTIMER_DB_MAX_CONNECTIONS", 80)
+    return max(1, min(threads, budget // workers - max_overflow - 1))
+
+
+def engine_options(database_url, production):
+    """SQLALCHEMY_ENGINE_OPTIONS for database_url; SQLite keeps its defaults."""
+    if (database_url or "").startswith("sqlite"):
+        return {}
+    max_overflow = _env("DDTIMER_DB_MAX_OVERFLOW", 2)
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": _env("DDTIMER_DB_POOL_SIZE", default_pool_size(production, max_overflow)),
+        "max_overflow": max_overflow,
+        "pool_timeout": _env("DDTIMER_DB_POOL_TIMEOUT", 10.0, float),
+        "pool_recycle": _env("DDTIMER_DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": _env("DDTIMER_DB_POOL_PRE_PING", True, _flag),
+    }
+    statement_timeout = _env("DDTIMER_DB_STATEMENT_TIMEOUT_MS", 0)
+    if statement_timeout > 0 and database_url.startswith("postgres"):
+        options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout}"}
+    return options
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            metrics.incr("db_pool_timeouts_total")
+            raise
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        metrics.observe("db_pool_wait", waited)
+        return connection
+
+
+def pool_stats(pool):
+    stats = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout(),
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            "checkouts": pool.checkouts,
+            "timeouts": pool.timeouts,
+            "wait_mean_ms": round(pool.wait_total / pool.checkouts * 1000, 3) if pool.checkouts else 0.0,
+            "wait_max_ms": round(pool.wait_max * 1000, 3),
+        })
+    return stats
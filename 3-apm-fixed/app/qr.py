@@ -0,0 +1,33 @@
+import hashlib
+import io
+import os
+from functools import lru_cache
+
+# Rendered QR codes are pure functions of (data, format, box size), so they
+# are cached in a bounded LRU and served with a content-derived ETag.
+#
+# qrcode (and PIL with it) is imported on the first render rather than at
+# startup: only /qr-image needs it, and it is a large share of import time.
+
+QR_CACHE_SIZE = int(os.environ.get("DDTIMER_QR_CACHE_SIZE", 256))
+QR_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+DEFAULT_BOX_SIZE = 10
+MAX_BOX_SIZE = 40
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_qr(data, fmt="png", box_size=DEFAULT_BOX_SIZE):
+    """Return (body bytes, strong etag) for a QR code of data."""
+    import qrcode
+    import qrcode.image.svg
+
+    buf = io.BytesIO()
+    if fmt == "svg":
+        # Vector output skips PIL rasterisation and PNG encoding entirely
+        img = qrcode.make(data, image_factory=qrcode.image.svg.SvgPathImage, box_size=box_size)
+        img.save(buf)
+    else:
+        img = qrcode.make(data, box_size=box_size)
+        img.save(buf, format="PNG")
+    body = buf.getvalue()
+    return body, hashlib.sha1(body).hexdigest()
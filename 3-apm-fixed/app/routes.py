@@ -1,66 +1,142 @@
-import io
+import copy
 import os
 import json
-import qrcode
-import time
 
-from pathlib import Path
 import random
+import secrets
 import string
 
 from flask import (
     Blueprint,
     render_template,
     request,
-    send_file,
     jsonify,
-    abort
+    abort,
+    redirect,
+    url_for,
+    send_from_directory,
+    stream_with_context,
+    Response
 )
 from werkzeug.utils import secure_filename
 
-from collections import defaultdict
-from datetime import datetime
-from threading import Lock
 
-from .models import SessionState
+from .counters import create_counter_store
+from .backgrounds import BackgroundVariants
+from .events import SessionNotifier, StateChangeFeed
+from .compression import PageCache
+from .metrics import metrics
+from .json_patch import MERGE_PATCH, JSON_PATCH, PatchError, PatchConflict
+from .pool import pool_stats
+from .uploads import store_upload, unreferenced_blobs, UploadTooLarge
+from .scan_persistence import ScanCountWriter
+from .config_cache import golden_standard_cache, config_cache
+from .state_cache import StateCache
+from .storage import create_store, PreconditionFailed
+from .qr import render_qr, QR_FORMATS, DEFAULT_BOX_SIZE, MAX_BOX_SIZE
 from . import db
 
-session_configs = defaultdict(lambda: _load_default_from_file())
+# Session-scoped scan counters for /done, /ping, /reset (shared across
+# workers when DDTIMER_COUNTER_FILE is set)
+counters = create_counter_store()
+scan_notifier = SessionNotifier(poll_interval=counters.poll_interval)
+# Batched write-behind of counts to the session_counts table
+scan_writer = ScanCountWriter(counters)
 
-# In-memory session-scoped tracking for /done, /ping, /reset
-sessions = defaultdict(lambda: {"count": 0, "last_ping": datetime.now()})
+# Long-poll / stream tuning for /ping
+PING_MAX_WAIT = 30          # seconds a long-poll /ping may block
+STREAM_HEARTBEAT = 15       # seconds between SSE keep-alive comments
+
+QR_MAX_AGE = 86400          # QR images only depend on the query string
+
+# Repeat /done scans from one device count once per session until /reset.
+# The device is named by a long-lived cookie that its first scan sets, or
+# by ?device=<token> when it has no cookie; DDTIMER_DONE_DEDUP=0 counts
+# every request.
+DONE_DEDUP = os.environ.get("DDTIMER_DONE_DEDUP", "1") != "0"
+DEVICE_COOKIE = "ddtimer_device"
+DEVICE_COOKIE_MAX_AGE = 365 * 86400
+MAX_DEVICE_TOKEN = 64
+
+# Right-sized background derivatives, built off the request thread
+backgrounds = BackgroundVariants()
+VARIANT_MAX_AGE = 31536000  # variant names are content hashes
+
+# Static pages rendered once, kept identity/gzip/brotli encoded
+pages = PageCache()
+
+# Where session states live (Postgres, SQLite or memory, by DATABASE_URL),
+# behind a read-through cache kept coherent by Postgres NOTIFY
+state_cache = StateCache()
+store = create_store(os.environ.get("DATABASE_URL"), state_cache)
+# Committed state changes relayed to /api/session-state/stream clients: this
+# worker's writes directly, other workers' through the NOTIFY listener
+state_changes = StateChangeFeed()
+store.add_change_listener(state_changes.publish)
+state_cache.add_change_listener(state_changes.publish)
+BATCH_MAX_SESSIONS = 200      # session ids per /api/sessions/batch request
 
 main = Blueprint("main", __name__)
 
 ADMIN_CLEAR_PASSWORD = "3.1415!"   # reuse same password
 
-def _load_default_from_file() -> dict:
-    return _load_golden_standard()
-
-# --- Database-backed session state helpers ---
+# --- Session state helpers (backend chosen by DATABASE_URL, see app/storage) ---
 def get_session_state(session_id):
-    record = SessionState.query.filter_by(session_id=session_id).first()
-    # Always return a dict, never None
-    return record.state if record and record.state is not None else {}
+    return get_session_state_versioned(session_id)[0]
+
+@metrics.timed("session_state_get")
+def get_session_state_versioned(session_id):
+    """Return (state, version); version is 0 for sessions never saved.
+
+    Served from state_cache when possible; the returned state is read-only.
+    """
+    return store.get(session_id)
+
+@metrics.timed("session_state_get_many")
+def get_session_states_versioned(session_ids):
+    """{session_id: (state, version)} for many sessions in at most one query."""
+    return store.get_many(session_ids)
+
+def get_session_version(session_id):
+    """Version-only lookup for conditional GETs; doesn't fetch the document."""
+    return store.version(session_id)
+
+def _state_etag(version):
+    return f"v{version}"
 
 def set_session_state(session_id, state):
-    record = SessionState.query.filter_by(session_id=session_id).first()
-    if record:
-        record.state = state
-    else:
-        record = SessionState(session_id=session_id, state=state)
-        db.session.add(record)
-    db.session.commit()
+    """Returns the new version."""
+    return set_session_states({session_id: state})[session_id]
+
+@metrics.timed("session_state_set")
+def set_session_states(states):
+    """Upsert {session_id: state} in one write; returns {session_id: new version}."""
+    return store.set_many(states) if states else {}
+
+@metrics.timed("session_state_patch")
+def patch_session_state(session_id, patch, merge=True, versions=None):
+    """Apply a merge patch (or JSON Patch) to a stored state; returns the new version.
+
+    versions: acceptable current versions from If-Match, or None for any.
+    Raises PreconditionFailed, json_patch.PatchError or PatchConflict.
+    """
+    if isinstance(patch, dict if merge else list) and not patch:
+        # Changes nothing: no write, no new version, no state event
+        version = get_session_version(session_id)
+        if versions is not None and version not in versions:
+            raise PreconditionFailed(version)
+        return version
+    return store.patch(session_id, patch, merge, versions)
 
 # --- Routes ---
 
 @main.route("/")
 def home():
-    return render_template("popup.html")
+    return pages.response("popup.html")
 
 @main.route("/settings")
 def settings():
-    return render_template("settings.html")
+    return pages.response("settings.html")
 
 @main.route("/edit-config", methods=["GET", "POST"])
 def edit_config():
@@ -86,26 +162,167 @@ def edit_config():
     pretty = json.dumps(content, indent=2)
     return render_template("edit-config.html", config_content=pretty)
 
-@main.route("/api/session-state", methods=["GET", "POST"])
+def _if_match_versions():
+    """Versions named by If-Match ("v3"), None when absent or "*"."""
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    versions = set()
+    for etag in request.if_match.as_set(include_weak=True):
+        if etag.startswith("v") and etag[1:].isdigit():
+            versions.add(int(etag[1:]))
+    return versions
+
+@main.route("/api/session-state", methods=["GET", "POST", "PATCH"])
 def api_session_state():
     session_id = request.args.get("session", "default")
     if request.method == "GET":
-        state = get_session_state(session_id)
-        return jsonify(state)
+        # Pollers send If-None-Match; answer from the version column alone
+        if request.if_none_match:
+            etag = _state_etag(get_session_version(session_id))
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+        state, version = get_session_state_versioned(session_id)
+        response = jsonify(state)
+        response.set_etag(_state_etag(version))
+        response.cache_control.no_cache = True
+        return response
     elif request.method == "POST":
         try:
             data = request.get_json(force=True)
         except Exception as e:
             return jsonify({"error": f"Invalid JSON: {e}"}), 400
-        set_session_state(session_id, data)
-        return jsonify({"ok": True})
+        version = set_session_state(session_id, data)
+        response = jsonify({"ok": True, "version": version})
+        response.set_etag(_state_etag(version))
+        return response
+    else:
+        # Partial update: only the changed fields travel and get rewritten
+        try:
+            patch = request.get_json(force=True)
+        except Exception as e:
+            return jsonify({"error": f"Invalid JSON: {e}"}), 400
+        merge = request.mimetype != JSON_PATCH and not (
+            request.mimetype != MERGE_PATCH and isinstance(patch, list)
+        )
+        try:
+            version = patch_session_state(session_id, patch, merge, _if_match_versions())
+        except PreconditionFailed as e:
+            response = jsonify({"error": str(e), "version": e.version})
+            response.status_code = 412
+            if e.version:
+                response.set_etag(_state_etag(e.version))
+            return response
+        except PatchConflict as e:
+            return jsonify({"error": str(e)}), 409
+        except PatchError as e:
+            return jsonify({"error": str(e)}), 400
+        response = jsonify({"ok": True, "version": version})
+        response.set_etag(_state_etag(version))
+        return response
 
-@main.route("/done")
-def done():
+def current_state_version(session_id):
+    """Version for a state stream; hands the DB connection back right away,
+    since the stream itself stays open."""
+    store.ensure_listener()
+    try:
+        return get_session_version(session_id)
+    finally:
+        db.session.remove()
+
+def state_event(version, event=None):
+    data = f"data: {json.dumps({'version': version})}\n\n"
+    return f"event: {event}\n{data}" if event else data
+
+@main.route("/api/session-state/stream")
+def session_state_stream():
+    """Server-Sent Events feed of the session's state version; pushes only on change.
+
+    Clients fetch the document when the version differs from theirs.
+    """
     session_id = request.args.get("session", "default")
-    sessions[session_id]["count"] += 1
-    sessions[session_id]["last_ping"] = datetime.now()
-    return """
+
+    def generate():
+        with state_changes.watch(session_id) as watch:
+            # Read after subscribing, so a write in between isn't missed
+            last = current_state_version(session_id)
+            yield "retry: 2000\n" + state_event(last)
+            while True:
+                changed = watch.wait(STREAM_HEARTBEAT)
+                version = watch.take() if changed else None
+                if version is None:
+                    # Also re-checked on every heartbeat, for writers this
+                    # worker can't hear from (SQLite with several workers)
+                    version = current_state_version(session_id)
+                if version != last:
+                    last = version
+                    yield state_event(version)
+                elif not changed:
+                    yield ": keep-alive\n\n"
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+def _session_progress(count, state):
+    teams = state.get("red_teams") or state.get("teams") or 0
+    try:
+        teams = int(teams)
+    except (TypeError, ValueError):
+        teams = 0
+    return {
+        "teams": teams,
+        "done": min(count, teams) if teams > 0 else count,
+        "progress": round(min(count / teams, 1.0), 4) if teams > 0 else None,
+    }
+
+@main.route("/api/sessions/batch", methods=["GET", "POST"])
+def api_sessions_batch():
+    """State, scan count and progress of many sessions, plus a summary.
+
+    GET /api/sessions/batch?ids=a,b,c or POST {"sessions": ["a", "b", "c"]}.
+    """
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        session_ids = data.get("sessions")
+        if not isinstance(session_ids, list) or not all(isinstance(sid, str) for sid in session_ids):
+            return jsonify({"error": "Expected {\"sessions\": [session ids]}"}), 400
+    else:
+        session_ids = [sid for sid in request.args.get("ids", "").split(",") if sid]
+    session_ids = list(dict.fromkeys(session_ids))
+    if not session_ids:
+        return jsonify({"error": "No session ids given"}), 400
+    if len(session_ids) > BATCH_MAX_SESSIONS:
+        return jsonify({"error": f"At most {BATCH_MAX_SESSIONS} sessions per request"}), 400
+
+    states = get_session_states_versioned(session_ids)
+    sessions = {}
+    summary = {"sessions": len(session_ids), "total_scans": 0, "total_done": 0,
+               "total_teams": 0, "completed_sessions": 0}
+    for session_id in session_ids:
+        state, version = states[session_id]
+        count = counters.get(session_id)
+        entry = {"state": state, "version": version, "count": count}
+        entry.update(_session_progress(count, state))
+        sessions[session_id] = entry
+        summary["total_scans"] += count
+        summary["total_done"] += entry["done"]
+        summary["total_teams"] += entry["teams"]
+        if entry["teams"] > 0 and count >= entry["teams"]:
+            summary["completed_sessions"] += 1
+    summary["progress"] = (
+        round(min(summary["total_done"] / summary["total_teams"], 1.0), 4)
+        if summary["total_teams"] else None
+    )
+    response = jsonify({"sessions": sessions, "summary": summary})
+    response.cache_control.no_cache = True
+    return response
+
+# --- Scan counting (shared with the ASGI fast path in app/asgi.py) ---
+
+DONE_PAGE = """
 <html>
   <head>
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
@@ -125,78 +342,276 @@ def done():
 </html>
 """
 
+def device_token(query_token, cookie_token):
+    """(token, new) identifying the scanning device; a new token must be set as the cookie.
+
+    The cookie wins: ?device= only names devices that have none, so a device
+    parameter copied into a shared QR code URL can't merge everyone's scans.
+    """
+    for token in (cookie_token, query_token):
+        if token and len(token) <= MAX_DEVICE_TOKEN:
+            return token, False
+    return secrets.token_urlsafe(16), True
+
+def record_scan(session_id, token=None):
+    """Count a scan; with a device token, only its first scan of the session counts."""
+    if token is None:
+        count = counters.incr(session_id)
+    else:
+        count, counted = counters.incr_once(session_id, token)
+        if not counted:
+            metrics.incr("duplicate_scans_total")
+            return count
+    metrics.incr("scans_total")
+    scan_notifier.notify(session_id)
+    scan_writer.mark_dirty(session_id)
+    return count
+
+def reset_scans(session_id):
+    counters.reset(session_id)
+    metrics.incr("resets_total")
+    scan_notifier.notify(session_id)
+    scan_writer.mark_dirty(session_id)
+
+@main.route("/done")
+@metrics.timed("done")
+def done():
+    session_id = request.args.get("session", "default")
+    if not DONE_DEDUP:
+        record_scan(session_id)
+        return DONE_PAGE
+    token, new = device_token(request.args.get("device"), request.cookies.get(DEVICE_COOKIE))
+    record_scan(session_id, token)
+    response = Response(DONE_PAGE, mimetype="text/html")
+    if new:
+        response.set_cookie(DEVICE_COOKIE, token, max_age=DEVICE_COOKIE_MAX_AGE,
+                            httponly=True, samesite="Lax")
+    return response
+
 @main.route("/ping")
 def ping():
     session_id = request.args.get("session", "default")
-    return str(sessions[session_id]["count"])
+    # Long-poll: /ping?since=N&wait=S blocks until the count differs from N
+    since = request.args.get("since", type=int)
+    if since is None:
+        with metrics.timer("ping"):
+            return str(counters.get(session_id))
+    with metrics.timer("ping_wait"):
+        wait = min(request.args.get("wait", PING_MAX_WAIT, type=float), PING_MAX_WAIT)
+        scan_notifier.wait_for(
+            session_id, lambda: counters.get(session_id) != since, max(wait, 0)
+        )
+        return str(counters.get(session_id))
+
+@main.route("/ping/stream")
+def ping_stream():
+    """Server-Sent Events feed of the scan count; pushes only on change.
+
+    With ?state=1 the stream also carries "state" events with the session's
+    state version (as /api/session-state/stream does), so a display follows
+    both over one connection.
+    """
+    session_id = request.args.get("session", "default")
+    if request.args.get("state") != "1":
+        return Response(_count_events(session_id), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+
+    def generate():
+        # State changes wake the same wait as scans
+        with state_changes.watch(session_id, lambda: scan_notifier.notify(session_id)) as watch:
+            version = current_state_version(session_id)
+            last = counters.get(session_id)
+            yield f"retry: 2000\ndata: {last}\n\n" + state_event(version, "state")
+            while True:
+                changed = scan_notifier.wait_for(
+                    session_id,
+                    lambda: watch.pending or counters.get(session_id) != last,
+                    STREAM_HEARTBEAT,
+                )
+                chunk = ""
+                if counters.get(session_id) != last:
+                    last = counters.get(session_id)
+                    chunk += f"data: {last}\n\n"
+                pending = watch.pending
+                current = watch.take() if pending else None
+                if current is None and (pending or not changed):
+                    # Also re-checked on every heartbeat (see session_state_stream)
+                    current = current_state_version(session_id)
+                if current is not None and current != version:
+                    version = current
+                    chunk += state_event(version, "state")
+                if chunk:
+                    yield chunk
+                elif not changed:
+                    yield ": keep-alive\n\n"
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+def _count_events(session_id):
+    last = counters.get(session_id)
+    yield f"retry: 2000\ndata: {last}\n\n"
+    while True:
+        changed = scan_notifier.wait_for(
+            session_id, lambda: counters.get(session_id) != last, STREAM_HEARTBEAT
+        )
+        if not changed:
+            yield ": keep-alive\n\n"
+            continue
+        last = counters.get(session_id)
+        yield f"data: {last}\n\n"
 
 @main.route("/reset", methods=["POST"])
 def reset():
     session_id = request.args.get("session", "default")
-    sessions[session_id]["count"] = 0
-    sessions[session_id]["last_ping"] = datetime.now()
+    reset_scans(session_id)
     return "OK"
 
 @main.route("/qr-popup")
 def qr_popup():
-    return render_template("qr_popup.html")
+    return pages.response("qr_popup.html")
 
 @main.route("/view-config")
 def view_config():
     try:
-        cfg_path = os.path.join("config", "config.json")
-        with open(cfg_path, "r") as f:
-            content = json.load(f)
-            pretty = json.dumps(content, indent=2)
-            return pretty, 200, {"Content-Type": "application/json"}
+        return _cached_json_response(config_cache.get())
     except Exception as e:
         return f"Error loading config: {e}", 500
 
 @main.route("/api/config")
 def api_config():
-    session_id = request.args.get("session", "default")
-    return jsonify(session_configs[session_id])
+    # Per-session configs are never stored separately; every session reads the
+    # golden standard, so unknown ?session= values allocate nothing
+    return api_golden_standard()
 
 @main.route("/qr-image")
 def qr_image():
     session = request.args.get("session", "default")
-    img = qrcode.make(session)
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return send_file(buf, mimetype="image/png")
+    fmt = request.args.get("format", "png")
+    if fmt not in QR_FORMATS:
+        return jsonify({"error": f"Unsupported format: {fmt}"}), 400
+    box_size = request.args.get("size", DEFAULT_BOX_SIZE, type=int)
+    box_size = max(1, min(box_size, MAX_BOX_SIZE))
+    with metrics.timer("qr_render"):
+        body, etag = render_qr(session, fmt, box_size)
+    response = Response(body, mimetype=QR_FORMATS[fmt])
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = QR_MAX_AGE
+    return response.make_conditional(request)
 
 @main.route("/upload-background", methods=["POST"])
 def upload_background():
-    session = request.args.get("session", "default")
     if "bg_file" not in request.files:
         return jsonify({"error": "No file provided"}), 400
     file = request.files["bg_file"]
     if file.filename == "":
         return jsonify({"error": "No file selected"}), 400
     if file:
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{session}_{name}_{int(time.time())}{ext}"
-        static_dir = Path("app/static")
-        static_dir.mkdir(exist_ok=True)
-        file_path = static_dir / unique_filename
+        # Stored by content hash: re-uploads of the same image share one file
         try:
-            file.save(str(file_path))
-            return jsonify({"filename": unique_filename})
+            filename = store_upload(file.stream, secure_filename(file.filename), backgrounds.static_dir)
+        except UploadTooLarge as e:
+            return jsonify({"error": str(e)}), 413
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": f"Failed to save file: {str(e)}"}), 500
+        backgrounds.submit(filename)
+        return jsonify({"filename": filename})
     return jsonify({"error": "Invalid file"}), 400
 
+def background_refcounts():
+    """{background filename: number of references} from sessions and the golden standard."""
+    counts = store.background_refcounts()
+    default = _load_golden_standard().get("background_image")
+    if default:
+        counts[default] = counts.get(default, 0) + 1
+    return counts
+
+@main.route("/api/cleanup-backgrounds", methods=["POST"])
+def cleanup_backgrounds():
+    data = request.get_json(silent=True) or {}
+    if data.get("password") != ADMIN_CLEAR_PASSWORD:
+        return jsonify({"error": "Invalid password"}), 403
+    refcounts = background_refcounts()
+    deleted = []
+    for name in unreferenced_blobs(backgrounds.static_dir, refcounts):
+        os.unlink(os.path.join(backgrounds.static_dir, name))
+        backgrounds.discard(name)
+        deleted.append(name)
+    return jsonify({"deleted": deleted, "refcounts": refcounts})
+
+@main.route("/bg/<filename>")
+def background(filename):
+    """Redirect to the best variant of a background for ?w=<display px>."""
+    if filename.startswith(".") or not os.path.isfile(os.path.join(backgrounds.static_dir, filename)):
+        abort(404)
+    width = request.args.get("w", 1920, type=int)
+    # Only an explicit image/webp counts; image/* is also sent by browsers without WebP
+    accept_webp = "image/webp" in request.headers.get("Accept", "")
+    variant = backgrounds.best_variant(filename, width, accept_webp)
+    if variant is None:
+        # Not processed yet (or failed): serve the original meanwhile
+        backgrounds.submit(filename)
+        response = redirect(url_for("static", filename=filename))
+        response.cache_control.no_cache = True
+        return response
+    response = redirect(url_for("main.background_variant", filename=variant))
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    response.vary.add("Accept")
+    return response
+
+@main.route("/bg-variant/<filename>")
+def background_variant(filename):
+    response = send_from_directory(backgrounds.variants_dir, filename, max_age=VARIANT_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@metrics.timed("golden_standard_load")
 def _load_golden_standard() -> dict:
-    gs_path = Path("config/golden_standard.json")
     try:
-        with gs_path.open() as f:
-            return json.load(f)
+        # Copy so callers can't mutate the shared cached document
+        return copy.deepcopy(golden_standard_cache.get().data)
     except Exception as exc:
-        print(f"[facilitator-timer] Could not read {gs_path}: {exc}")
+        print(f"[facilitator-timer] Could not read {golden_standard_cache.path}: {exc}")
         return {}
 
+def _cached_json_response(entry):
+    """Serve pre-serialized JSON; clients revalidate and get 304 while unchanged."""
+    response = Response(entry.body, mimetype="application/json")
+    response.set_etag(entry.etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@main.route("/api/stats")
+def api_stats():
+    return jsonify({
+        "storage": store.stats(),
+        "state_cache": state_cache.stats(),
+        "state_streams": state_changes.stats(),
+        "db_pool": pool_stats(db.engine.pool),
+        "counters": counters.stats(),
+        "pages": pages.stats(),
+        "scan_counts": scan_writer.stats(),
+    })
+
+@main.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 @main.route("/api/golden-standard", methods=["GET"])
 def api_golden_standard():
-    return jsonify(_load_golden_standard())
\ No newline at end of file
+    try:
+        with metrics.timer("golden_standard_load"):
+            entry = golden_standard_cache.get()
+        return _cached_json_response(entry)
+    except Exception as exc:
+        print(f"[facilitator-timer] Could not read {golden_standard_cache.path}: {exc}")
+        return jsonify({})
@@ -0,0 +1,115 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import db
+from .models import SessionCount
+
+# Write-behind persistence of /done counts.
+#
+# /done only marks its session dirty in memory. A background thread in each
+# worker flushes the dirty sessions every DDTIMER_COUNT_FLUSH_INTERVAL
+# seconds (and at exit) as one multi-row upsert of their absolute counts, so
+# a burst of scans costs one statement per interval. On startup the persisted
+# counts are loaded back into the counter store (none before init_db.py has
+# created the table).
+
+FLUSH_INTERVAL = float(os.environ.get("DDTIMER_COUNT_FLUSH_INTERVAL", 2.0))
+
+logger = logging.getLogger(__name__)
+
+
+class ScanCountWriter:
+    def __init__(self, counters, interval=FLUSH_INTERVAL):
+        self.counters = counters
+        self.interval = interval
+        self.app = None
+        self.flushes = 0
+        self.rows_written = 0
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread_pid = None
+
+    def init_app(self, app):
+        if self.interval <= 0:
+            return
+        self.app = app
+        self.restore()
+        atexit.register(self.flush)
+
+    def mark_dirty(self, session_id):
+        if self.app is None:
+            return
+        with self._lock:
+            self._dirty.add(session_id)
+        if self._thread_pid != os.getpid():
+            # Started lazily so it runs in each forked worker, not the master
+            self._thread_pid = os.getpid()
+            threading.Thread(target=self._run, name="scan-count-writer", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            try:
+                self.flush()
+            except Exception as exc:
+                logger.warning("Could not flush scan counts: %s", exc)
+
+    def flush(self):
+        """Write every dirty session's current count in one statement."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        rows = []
+        for session_id in dirty:
+            snapshot = self.counters.snapshot(session_id)
+            if snapshot is not None:
+                rows.append({"session_id": session_id, "count": snapshot[0], "changed_at": snapshot[1]})
+        if not rows:
+            return
+        try:
+            with self.app.app_context():
+                insert = pg_insert if db.engine.dialect.name == "postgresql" else sqlite_insert
+                stmt = insert(SessionCount).values(rows)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[SessionCount.session_id],
+                    set_={"count": stmt.excluded.count, "changed_at": stmt.excluded.changed_at},
+                    where=SessionCount.changed_at <= stmt.excluded.changed_at,
+                )
+                db.session.execute(stmt)
+                db.session.commit()
+        except Exception:
+            # Keep the sessions dirty so the next interval retries them
+            with self._lock:
+                self._dirty.update(row["session_id"] for row in rows)
+            raise
+        self.flushes += 1
+        self.rows_written += len(rows)
+
+    def restore(self):
+        try:
+            with self.app.app_context():
+                if not inspect(db.engine).has_table(SessionCount.__tablename__):
+                    # Fresh database; init_db.py hasn't created the table yet
+                    return
+                # Oldest first, so a bounded store evicts the stalest sessions
+                rows = db.session.execute(
+                    db.select(SessionCount.session_id, SessionCount.count, SessionCount.changed_at)
+                    .where(SessionCount.changed_at >= time.time() - self.counters.ttl)
+                    .order_by(SessionCount.changed_at)
+                ).all()
+        except Exception as exc:
+            logger.warning("Could not restore scan counts: %s", exc)
+            return
+        for row in rows:
+            self.counters.restore(row.session_id, row.count, row.changed_at)
+        logger.info("Restored scan counts for %d sessions", len(rows))
+
+    def stats(self):
+        return {"dirty": len(self._dirty), "flushes": self.flushes, "rows_written": self.rows_written}
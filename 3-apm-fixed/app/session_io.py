@@ -0,0 +1,237 @@
+import csv
+import io
+import json
+import re
+
+from . import db
+from .state_cache import NOTIFY_CHANNEL, NOTIFY_CLEAR_ALL
+
+# Streaming backup and restore of session_states as NDJSON, one
+# {"session_id", "state", "version", "updated_at"} object per line.
+#
+# Nothing here holds more than one batch of sessions in memory. On Postgres
+# export is a COPY ... TO STDOUT of JSON built by the server, and import is
+# a COPY FROM STDIN into a temporary staging table followed by one upsert,
+# all in one transaction; other backends fall back to a streamed SELECT and
+# upserts committed a batch at a time.
+
+BATCH_SIZE = 500
+READ_CHUNK = 64 * 1024
+# CSV with quote/delimiter bytes that never occur in JSON text, so COPY
+# writes each JSON document out unescaped
+COPY_OUT_OPTIONS = "FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02'"
+
+
+def _postgres():
+    from .routes import store
+
+    return store.name == "postgresql"
+
+
+def _cursor():
+    """DBAPI cursor on the connection of the current session transaction."""
+    return db.session.connection().connection.dbapi_connection.cursor()
+
+
+class _LineCounter:
+    def __init__(self, out):
+        self.out = out
+        self.lines = 0
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode()
+        self.lines += data.count("\n")
+        self.out.write(data)
+
+
+def export_ndjson(out):
+    """Write every session to the text stream `out`; returns how many."""
+    if _postgres():
+        counter = _LineCounter(out)
+        with _cursor() as cur:
+            cur.copy_expert(
+                "COPY (SELECT jsonb_build_object('session_id', session_id, 'state', state, "
+                "'version', version, 'updated_at', updated_at)::text "
+                f"FROM session_states ORDER BY session_id) TO STDOUT WITH ({COPY_OUT_OPTIONS})",
+                counter,
+            )
+        return counter.lines
+    from .routes import store
+
+    count = 0
+    for session_id, state, version, updated_at in store.iter_all():
+        if hasattr(updated_at, "isoformat"):
+            updated_at = updated_at.isoformat()
+        out.write(json.dumps({"session_id": session_id, "state": state,
+                              "version": version, "updated_at": updated_at}) + "\n")
+        count += 1
+    return count
+
+
+def read_ndjson(lines):
+    """(session_id, state) for each line of an export."""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            raise ValueError(f"line {number}: {exc}") from None
+        session_id = record.get("session_id") if isinstance(record, dict) else None
+        state = record.get("state") if isinstance(record, dict) else None
+        if not isinstance(session_id, str) or not session_id or not isinstance(state, dict):
+            raise ValueError(f"line {number}: expected {{\"session_id\": str, \"state\": object}}")
+        yield session_id, state
+
+
+class _CopySource:
+    """File-like CSV feed for COPY FROM STDIN, encoded from rows as it is read."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf, lineterminator="\n")
+        self._pending = ""
+        self.count = 0
+        # psycopg2 reports errors raised in read() as QueryCanceled; keep the original
+        self.error = None
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            try:
+                session_id, state = next(self._rows)
+            except StopIteration:
+                break
+            except Exception as exc:
+                self.error = exc
+                raise
+            self._writer.writerow([session_id, json.dumps(state)])
+            self.count += 1
+            self._pending += self._buf.getvalue()
+            self._buf.seek(0)
+            self._buf.truncate()
+        if size < 0:
+            size = len(self._pending)
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+
+    readline = read
+
+
+def import_sessions(rows):
+    """Upsert (session_id, state) rows; returns how many were read.
+
+    A session appearing more than once takes its last state. On Postgres the
+    whole import is one transaction. Other backends commit every BATCH_SIZE
+    sessions, so an import that fails partway leaves the batches before the
+    failure saved; re-running the same file finishes it.
+    """
+    if _postgres():
+        db.session.execute(db.text(
+            "CREATE TEMP TABLE session_states_import "
+            "(ord bigserial, session_id text NOT NULL, state jsonb NOT NULL) ON COMMIT DROP"
+        ))
+        source = _CopySource(rows)
+        with _cursor() as cur:
+            try:
+                cur.copy_expert("COPY session_states_import (session_id, state) FROM STDIN WITH (FORMAT csv)", source)
+            except Exception:
+                if source.error is not None:
+                    raise source.error from None
+                raise
+        db.session.execute(db.text(
+            "INSERT INTO session_states (session_id, state) "
+            "SELECT DISTINCT ON (session_id) session_id, state FROM session_states_import "
+            "ORDER BY session_id, ord DESC "
+            "ON CONFLICT (session_id) DO UPDATE SET state = excluded.state, "
+            "version = session_states.version + 1, updated_at = now()"
+        ))
+        # One message instead of one per session: every worker drops its cache
+        db.session.execute(db.text("SELECT pg_notify(:channel, :payload)"),
+                           {"channel": NOTIFY_CHANNEL, "payload": NOTIFY_CLEAR_ALL})
+        db.session.commit()
+        return source.count
+
+    from .routes import set_session_states, state_cache
+
+    count = 0
+    batch = {}
+    for session_id, state in rows:
+        batch[session_id] = state
+        count += 1
+        if len(batch) >= BATCH_SIZE:
+            set_session_states(batch)
+            batch = {}
+    set_session_states(batch)
+    state_cache.clear()
+    return count
+
+
+_WHITESPACE = re.compile(r"\s*")
+
+
+class _JSONStream:
+    """Incremental reader over one large JSON text, a chunk at a time."""
+
+    def __init__(self, f, chunk_size=READ_CHUNK):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        data = self.f.read(self.chunk_size)
+        self.eof = not data
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def peek(self):
+        """Next non-whitespace character, or "" at the end."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r} near {self.buf[self.pos:self.pos + 40]!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A value ending exactly at the buffer end may be a cut-off number
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def iter_legacy_sessions(f):
+    """(session_id, state) from the old config/session_states.json layout,
+    {"<session_id>": {...state...}, ...}, without loading the whole file."""
+    stream = _JSONStream(f)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        session_id = stream.value()
+        stream.expect(":")
+        state = stream.value()
+        if not isinstance(session_id, str) or not isinstance(state, dict):
+            raise ValueError(f"session {session_id!r}: state must be an object")
+        yield session_id, state
+        if stream.peek() == ",":
+            stream.pos += 1
+            continue
+        stream.expect("}")
+        return
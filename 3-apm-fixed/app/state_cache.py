@@ -0,0 +1,181 @@
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+# Read-through cache for session state documents.
+#
+# Each worker keeps a bounded LRU of (state, version) per session. Writers
+# invalidate their own cache directly and send a Postgres NOTIFY on
+# NOTIFY_CHANNEL inside the write transaction; a listener thread in every
+# worker invalidates on receipt. The cache only serves reads while that
+# listener is connected, so a lost connection can't leave stale documents.
+#
+# The payload is "<version>:<session_id>". The listener also hands every
+# change to its change listeners (the /api/session-state/stream relay), so
+# it runs even with the cache disabled once one is registered.
+
+NOTIFY_CHANNEL = "ddtimer_session_state"
+# Payload telling every listener to drop its whole cache (bulk imports)
+NOTIFY_CLEAR_ALL = "*"
+STATE_CACHE_SIZE = int(os.environ.get("DDTIMER_STATE_CACHE_SIZE", 1024))
+STATE_CACHE_WARM = int(os.environ.get("DDTIMER_STATE_CACHE_WARM", 0))
+
+logger = logging.getLogger(__name__)
+
+
+class StateCache:
+    def __init__(self, maxsize=STATE_CACHE_SIZE, warm=STATE_CACHE_WARM):
+        self.maxsize = maxsize
+        self.warm = warm
+        self.enabled = False  # flipped on by the listener once LISTEN is active
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Bumped on every invalidation; a read that started before an
+        # invalidation must not put its (possibly stale) result back
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener_pid = None
+        self._change_listeners = []
+
+    def get(self, session_id):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry
+
+    def put(self, session_id, entry, generation):
+        """Store (state, version) read while self.generation was `generation`.
+
+        Cached states are shared between requests and must be treated as read-only.
+        """
+        if not self.enabled or self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[session_id] = entry
+            self._entries.move_to_end(session_id)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, session_id):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            self._entries.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+    # --- Cross-process invalidation ---
+
+    def add_change_listener(self, fn):
+        """Call fn(session_id, version) for each NOTIFY; (None, None) means every session."""
+        self._change_listeners.append(fn)
+
+    def _changed(self, session_id, version):
+        for fn in self._change_listeners:
+            try:
+                fn(session_id, version)
+            except Exception as exc:
+                logger.warning("Session state change listener failed: %s", exc)
+
+    def ensure_listener(self, engine):
+        """Start the LISTEN thread once per process (workers fork after import)."""
+        if self._listener_pid == os.getpid():
+            return
+        if self.maxsize <= 0 and not self._change_listeners:
+            return
+        if engine.dialect.name != "postgresql":
+            return
+        self._listener_pid = os.getpid()
+        self.enabled = False
+        self.clear()
+        thread = threading.Thread(target=self._listen, args=(engine,), name="state-cache-listener", daemon=True)
+        thread.start()
+
+    def _listen(self, engine):
+        backoff = 1
+        reconnect = False
+        while True:
+            conn = None
+            try:
+                conn = engine.raw_connection()
+                conn.detach()  # long-lived; keep it out of the request pool
+                dbapi_conn = conn.dbapi_connection
+                dbapi_conn.autocommit = True
+                with dbapi_conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                self._warm_up(dbapi_conn)
+                self.enabled = True
+                if reconnect:
+                    # Changes made while disconnected were never heard
+                    self._changed(None, None)
+                reconnect = True
+                backoff = 1
+                while True:
+                    if select.select([dbapi_conn], [], [], 30) == ([], [], []):
+                        continue
+                    dbapi_conn.poll()
+                    while dbapi_conn.notifies:
+                        payload = dbapi_conn.notifies.pop(0).payload
+                        if payload == NOTIFY_CLEAR_ALL:
+                            self.clear()
+                            self._changed(None, None)
+                            continue
+                        version, _, session_id = payload.partition(":")
+                        if not version.isdigit():
+                            # Sent by an older release: the payload is the id
+                            version, session_id = None, payload
+                        self.invalidate(session_id)
+                        self._changed(session_id, int(version) if version else None)
+            except Exception as exc:
+                logger.warning("Session state cache listener disconnected: %s", exc)
+            self.enabled = False
+            self.clear()
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _warm_up(self, dbapi_conn):
+        if self.warm <= 0:
+            return
+        generation = self.generation
+        with dbapi_conn.cursor() as cur:
+            cur.execute(
+                "SELECT session_id, state, version FROM session_states "
+                "ORDER BY updated_at DESC LIMIT %s",
+                (min(self.warm, self.maxsize),),
+            )
+            rows = cur.fetchall()
+        self.enabled = True
+        for session_id, state, version in reversed(rows):
+            self.put(session_id, (state if state is not None else {}, version), generation)
+        logger.info("Warmed session state cache with %d sessions", len(rows))
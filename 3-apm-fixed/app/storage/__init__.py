@@ -0,0 +1,30 @@
+from .base import PreconditionFailed, SessionStore  # noqa: F401
+from .memory import MemoryStore
+from .postgres import PostgresStore
+from .sqlite import SQLiteStore
+
+# Session state storage, chosen by the scheme of DATABASE_URL:
+#
+#   postgresql://...      PostgresStore  JSONB, patches applied in SQL,
+#                                        cross-worker cache invalidation
+#   sqlite:///path.db     SQLiteStore    one file in WAL mode
+#   memory://             MemoryStore    this process only, lost on restart
+#
+# Routes only talk to the SessionStore interface.
+
+
+def create_store(database_url, cache=None):
+    url = database_url or ""
+    if url.startswith("memory:"):
+        return MemoryStore()
+    if url.startswith("sqlite"):
+        return SQLiteStore(cache)
+    return PostgresStore(cache)
+
+
+def sqlalchemy_url(database_url):
+    """The SQLAlchemy URL for database_url; memory:// gets an unused in-memory SQLite."""
+    if (database_url or "").startswith("memory:"):
+        return "sqlite://"
+    return database_url
+
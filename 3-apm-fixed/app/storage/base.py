@@ -0,0 +1,72 @@
+class PreconditionFailed(Exception):
+    """If-Match named a version other than the stored one."""
+
+    def __init__(self, version):
+        super().__init__(f"Session state is at version {version}")
+        self.version = version
+
+
+class SessionStore:
+    """Where session state documents live.
+
+    A state is a JSON object; every write bumps the session's version, and a
+    session that was never saved reads as ({}, 0). Returned states may be
+    shared with other readers and must be treated as read-only.
+    """
+
+    name = None
+    # False when states are lost on restart (scan counts aren't persisted either)
+    persistent = True
+
+    def __init__(self):
+        self._change_listeners = []
+
+    def init_app(self, app):
+        pass
+
+    def add_change_listener(self, fn):
+        """Call fn(session_id, version) after each write committed by this process."""
+        self._change_listeners.append(fn)
+
+    def _changed(self, versions):
+        for session_id, version in versions.items():
+            for fn in self._change_listeners:
+                fn(session_id, version)
+
+    def ensure_listener(self):
+        """Start hearing about other processes' writes, where the backend can."""
+
+    def get(self, session_id):
+        """(state, version)."""
+        raise NotImplementedError
+
+    def get_many(self, session_ids):
+        """{session_id: (state, version)} for every id asked for."""
+        raise NotImplementedError
+
+    def version(self, session_id):
+        """Version alone, for conditional GETs."""
+        return self.get(session_id)[1]
+
+    def set_many(self, states):
+        """Replace {session_id: state} in one write; returns {session_id: new version}."""
+        raise NotImplementedError
+
+    def patch(self, session_id, patch, merge=True, versions=None):
+        """Apply a merge patch (or JSON Patch) to a stored state; returns the new version.
+
+        versions: acceptable current versions from If-Match, or None for any.
+        Raises PreconditionFailed, json_patch.PatchError or PatchConflict.
+        """
+        raise NotImplementedError
+
+    def iter_all(self):
+        """(session_id, state, version, updated_at) for every session, by id."""
+        raise NotImplementedError
+
+    def background_refcounts(self):
+        """{background_image: number of sessions using it}."""
+        raise NotImplementedError
+
+    def stats(self):
+        return {"backend": self.name}
@@ -0,0 +1,74 @@
+import copy
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+
+from ..json_patch import PatchConflict, apply_json_patch, apply_merge_patch, validate_patch
+from .base import PreconditionFailed, SessionStore
+
+
+class MemoryStore(SessionStore):
+    """Session states in a dict of this process.
+
+    Nothing survives a restart and worker processes don't see each other's
+    writes, so it suits benchmarks, tests and single-worker demos only.
+    """
+
+    name = "memory"
+    persistent = False
+
+    def __init__(self):
+        super().__init__()
+        self._states = {}  # session_id -> (state, version, updated_at)
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        entry = self._states.get(session_id)
+        return (entry[0], entry[1]) if entry is not None else ({}, 0)
+
+    def get_many(self, session_ids):
+        return {session_id: self.get(session_id) for session_id in session_ids}
+
+    def version(self, session_id):
+        entry = self._states.get(session_id)
+        return entry[1] if entry is not None else 0
+
+    def set_many(self, states):
+        # Copied so the caller can't change a stored document afterwards
+        states = {session_id: copy.deepcopy(state) for session_id, state in states.items()}
+        now = datetime.now(timezone.utc)
+        versions = {}
+        with self._lock:
+            for session_id, state in states.items():
+                versions[session_id] = self.version(session_id) + 1
+                self._states[session_id] = (state, versions[session_id], now)
+        self._changed(versions)
+        return versions
+
+    def patch(self, session_id, patch, merge=True, versions=None):
+        validate_patch(patch, merge)
+        with self._lock:
+            state, version = self.get(session_id)
+            if versions is not None and version not in versions:
+                raise PreconditionFailed(version)
+            state = apply_merge_patch(state, patch) if merge else apply_json_patch(state, patch)
+            if not isinstance(state, dict):
+                raise PatchConflict("A session state must be an object")
+            self._states[session_id] = (state, version + 1, datetime.now(timezone.utc))
+        self._changed({session_id: version + 1})
+        return version + 1
+
+    def iter_all(self):
+        for session_id in sorted(self._states):
+            entry = self._states.get(session_id)
+            if entry is not None:
+                yield (session_id,) + entry
+
+    def background_refcounts(self):
+        return dict(Counter(
+            entry[0]["background_image"] for entry in list(self._states.values())
+            if isinstance(entry[0].get("background_image"), str)
+        ))
+
+    def stats(self):
+        return {"backend": self.name, "sessions": len(self._states)}
@@ -0,0 +1,59 @@
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+
+from .. import db
+from ..json_patch import json_patch_sql, merge_patch_sql
+from ..models import SessionState
+from ..state_cache import NOTIFY_CHANNEL
+from .sql import SQLStore
+
+
+class PostgresStore(SQLStore):
+    """JSONB documents; writers NOTIFY every worker's cache listener."""
+
+    name = "postgresql"
+    insert = staticmethod(pg_insert)
+
+    def _match_ids(self, session_ids):
+        # One statement text for any batch size: session_id = ANY(:ids)
+        ids = db.bindparam("ids", session_ids, type_=ARRAY(db.String))
+        return SessionState.session_id == db.any_(ids)
+
+    def _commit(self, versions):
+        # Delivered to every worker's cache listener when the transaction
+        # commits, as "<version>:<session_id>"
+        db.session.execute(
+            db.text(f"SELECT pg_notify('{NOTIFY_CHANNEL}', v || ':' || sid) "
+                    "FROM unnest(CAST(:ids AS text[]), CAST(:versions AS int[])) AS t(sid, v)"),
+            {"ids": list(versions), "versions": list(versions.values())},
+        )
+        super()._commit(versions)
+
+    def patch(self, session_id, patch, merge=True, versions=None):
+        # One UPDATE computes the new document with JSONB operators
+        if merge:
+            expression, params = merge_patch_sql(patch)
+            conditions = []
+        else:
+            expression, conditions, params = json_patch_sql(patch)
+        where = ["session_id = :session_id"] + conditions
+        if versions is not None:
+            where.append("version = ANY(:versions)")
+            params["versions"] = list(versions)
+        params["session_id"] = session_id
+        try:
+            version = db.session.execute(db.text(
+                f"UPDATE session_states SET state = {expression}, version = version + 1, "
+                f"updated_at = now() WHERE {' AND '.join(where)} RETURNING version"
+            ), params).scalar()
+        except DBAPIError:
+            # e.g. a non-numeric path token into an array; the Python path
+            # reports it as a conflict
+            version = None
+        if version is not None:
+            self._commit({session_id: version})
+            return version
+        db.session.rollback()
+        # Nothing matched: missing session, failed test or precondition;
+        # the Python path tells which
+        return super().patch(session_id, patch, merge, versions)
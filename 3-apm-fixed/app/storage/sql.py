@@ -0,0 +1,152 @@
+from .. import db
+from ..json_patch import PatchConflict, apply_json_patch, apply_merge_patch, validate_patch
+from ..models import SessionState
+from ..state_cache import StateCache
+from .base import PreconditionFailed, SessionStore
+
+
+class SQLStore(SessionStore):
+    """session_states through Flask-SQLAlchemy; dialect specifics live in subclasses.
+
+    Reads go through `cache`, which only serves while something keeps it
+    coherent across workers (the Postgres LISTEN thread).
+    """
+
+    insert = None  # dialect insert() supporting on_conflict_do_update
+
+    def __init__(self, cache=None):
+        super().__init__()
+        self.cache = cache if cache is not None else StateCache()
+
+    def ensure_listener(self):
+        self.cache.ensure_listener(db.engine)
+
+    def get(self, session_id):
+        self.cache.ensure_listener(db.engine)
+        cached = self.cache.get(session_id)
+        if cached is not None:
+            return cached
+        generation = self.cache.generation
+        row = db.session.execute(
+            db.select(SessionState.state, SessionState.version)
+            .filter_by(session_id=session_id)
+        ).first()
+        # Always return a dict, never None
+        if row is None:
+            result = ({}, 0)
+        else:
+            result = ((row.state if row.state is not None else {}), row.version)
+        self.cache.put(session_id, result, generation)
+        return result
+
+    def get_many(self, session_ids):
+        """In at most one query."""
+        self.cache.ensure_listener(db.engine)
+        results = {}
+        misses = []
+        for session_id in session_ids:
+            cached = self.cache.get(session_id)
+            if cached is not None:
+                results[session_id] = cached
+            else:
+                misses.append(session_id)
+        if not misses:
+            return results
+        generation = self.cache.generation
+        rows = db.session.execute(
+            db.select(SessionState.session_id, SessionState.state, SessionState.version)
+            .where(self._match_ids(misses))
+        ).all()
+        for row in rows:
+            results[row.session_id] = ((row.state if row.state is not None else {}), row.version)
+        for session_id in misses:
+            result = results.setdefault(session_id, ({}, 0))
+            self.cache.put(session_id, result, generation)
+        return results
+
+    def _match_ids(self, session_ids):
+        return SessionState.session_id.in_(session_ids)
+
+    def version(self, session_id):
+        """Doesn't fetch the document."""
+        cached = self.cache.get(session_id)
+        if cached is not None:
+            return cached[1]
+        version = db.session.execute(
+            db.select(SessionState.version).filter_by(session_id=session_id)
+        ).scalar()
+        return version or 0
+
+    def set_many(self, states):
+        """One INSERT ... ON CONFLICT DO UPDATE ... RETURNING."""
+        if not states:
+            return {}
+        stmt = self.insert(SessionState).values(
+            [{"session_id": sid, "state": state} for sid, state in states.items()]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SessionState.session_id],
+            set_={
+                "state": stmt.excluded.state,
+                "version": SessionState.version + 1,
+                "updated_at": db.func.now(),
+            },
+        )
+        rows = db.session.execute(stmt.returning(SessionState.session_id, SessionState.version))
+        versions = {row.session_id: row.version for row in rows}
+        self._commit(versions)
+        return versions
+
+    def _commit(self, versions):
+        """Commit writes that left sessions at {session_id: version}."""
+        db.session.commit()
+        for sid in versions:
+            self.cache.invalidate(sid)
+        self._changed(versions)
+
+    def patch(self, session_id, patch, merge=True, versions=None):
+        validate_patch(patch, merge)
+        # Apply in Python under an optimistic version check
+        for _ in range(5):
+            row = db.session.execute(
+                db.select(SessionState.state, SessionState.version).filter_by(session_id=session_id)
+            ).first()
+            if row is None:
+                # "v0" is the ETag of a session never saved
+                if versions is not None and 0 not in versions:
+                    raise PreconditionFailed(0)
+                state = apply_merge_patch({}, patch) if merge else apply_json_patch({}, patch)
+                if not isinstance(state, dict):
+                    raise PatchConflict("A session state must be an object")
+                return self.set_many({session_id: state})[session_id]
+            if versions is not None and row.version not in versions:
+                raise PreconditionFailed(row.version)
+            state = apply_merge_patch(row.state, patch) if merge else apply_json_patch(row.state, patch)
+            if not isinstance(state, dict):
+                raise PatchConflict("A session state must be an object")
+            updated = db.session.execute(
+                db.update(SessionState)
+                .where(SessionState.session_id == session_id, SessionState.version == row.version)
+                .values(state=state, version=row.version + 1, updated_at=db.func.now())
+            )
+            if updated.rowcount == 1:
+                self._commit({session_id: row.version + 1})
+                return row.version + 1
+            db.session.rollback()
+        raise PatchConflict("Session state kept changing; retry")
+
+    def iter_all(self, batch_size=500):
+        rows = db.session.execute(
+            db.select(SessionState.session_id, SessionState.state, SessionState.version, SessionState.updated_at)
+            .order_by(SessionState.session_id)
+            .execution_options(yield_per=batch_size)
+        )
+        for row in rows:
+            yield row.session_id, row.state, row.version, row.updated_at
+
+    def background_refcounts(self):
+        image = SessionState.state["background_image"].as_string()
+        rows = db.session.execute(
+            db.select(image, db.func.count()).where(image.isnot(None)).group_by(image)
+        ).all()
+        return {name: count for name, count in rows}
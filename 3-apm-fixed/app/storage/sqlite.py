@@ -0,0 +1,31 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .. import db
+from .sql import SQLStore
+
+# Milliseconds a writer waits for another connection's write lock
+BUSY_TIMEOUT_MS = int(os.environ.get("DDTIMER_SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+
+def _configure_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers proceed while one writer commits; NORMAL sync is
+    # durable across application crashes in WAL mode and skips an fsync per commit
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+class SQLiteStore(SQLStore):
+    """A local database file, for single-box deployments, CI and benchmarks."""
+
+    name = "sqlite"
+    insert = staticmethod(sqlite_insert)
+
+    def init_app(self, app):
+        with app.app_context():
+            event.listen(db.engine, "connect", _configure_connection)
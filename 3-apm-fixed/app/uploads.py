@@ -0,0 +1,72 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+# Content-addressed storage for uploaded backgrounds.
+#
+# An upload is copied to disk in chunks while it is hashed and then stored
+# as bg-<sha256 prefix><ext>, so identical images uploaded by any number of
+# sessions share one file. Werkzeug has already buffered the request body
+# (in memory, or a temporary file for larger uploads) by the time the copy
+# runs; reading it in chunks only keeps the copy itself from loading the
+# whole file. Blobs are reference-counted against the
+# background_image of every stored session state and deleted once unused.
+
+MAX_UPLOAD_BYTES = int(os.environ.get("DDTIMER_MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+# Uploaded blobs younger than this are kept even if no session references
+# them yet (the facilitator may not have saved settings)
+UNUSED_GRACE_SECONDS = int(os.environ.get("DDTIMER_UPLOAD_GRACE_SECONDS", 86400))
+CHUNK_SIZE = 64 * 1024
+ALLOWED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+BLOB_PATTERN = re.compile(r"^bg-[0-9a-f]{20}\.[a-z]+$")
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def store_upload(stream, original_name, static_dir):
+    """Hash and store an already-received upload; returns its content-addressed filename."""
+    ext = os.path.splitext(original_name)[1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise ValueError(f"Unsupported image type: {ext or 'none'}")
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=static_dir, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise UploadTooLarge(f"File exceeds {MAX_UPLOAD_BYTES} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+        filename = f"bg-{digest.hexdigest()[:20]}{ext}"
+        final_path = os.path.join(static_dir, filename)
+        if os.path.exists(final_path):
+            # Same bytes already stored; refresh mtime so cleanup's grace period restarts
+            os.utime(final_path)
+            os.unlink(tmp_path)
+        else:
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, final_path)
+        return filename
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def unreferenced_blobs(static_dir, refcounts, grace=UNUSED_GRACE_SECONDS):
+    """Content-addressed blobs with no references that are older than grace."""
+    cutoff = time.time() - grace
+    for name in sorted(os.listdir(static_dir)):
+        if not BLOB_PATTERN.match(name) or refcounts.get(name, 0) > 0:
+            continue
+        if os.path.getmtime(os.path.join(static_dir, name)) < cutoff:
+            yield name
@@ -0,0 +1,8 @@
+# ASGI entry point: uvicorn asgi:application --host 0.0.0.0 --port 5050
+#
+# Importing run first keeps ddtrace patching and JSON logging identical to
+# the WSGI entry points.
+from run import app
+from app.asgi import create_asgi_app
+
+application = create_asgi_app(app)
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""Class-wide /done burst while displays hold /ping/stream open: sync vs ASGI.
+
+Starts the app under gunicorn (gthread) and under uvicorn (app/asgi.py),
+opens --streams idle SSE connections like projector displays, then fires
+--burst concurrent /done requests, each on its own connection, like a room
+scanning the QR code at once.
+
+    python bench/bench_burst.py --streams 200 --burst 1000 --workers 1
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from httpload import Connection, free_port, percentile, start_server, stop_server  # noqa: E402
+
+
+async def burst(port, streams, students, timeout):
+    displays = [Connection("127.0.0.1", port) for _ in range(streams)]
+    opened = await asyncio.gather(
+        *(asyncio.wait_for(c.send("GET", "/ping/stream?session=burst"), timeout) for c in displays),
+        return_exceptions=True,
+    )
+    stream_errors = sum(isinstance(r, Exception) for r in opened)
+
+    latencies, errors = [], 0
+
+    async def student():
+        nonlocal errors
+        conn = Connection("127.0.0.1", port)
+        start = time.perf_counter()
+        try:
+            status, _, _ = await asyncio.wait_for(conn.request("GET", "/done?session=burst"), timeout)
+            if status != 200:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors += 1
+        finally:
+            await conn.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(student() for _ in range(students)))
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*(c.close() for c in displays))
+    latencies.sort()
+    return {
+        "stream_errors": stream_errors,
+        "done/s": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=200, help="open /ping/stream displays")
+    parser.add_argument("--burst", type=int, default=1000, help="concurrent /done requests")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    print(f"{'server':>6} {'done/s':>8} {'p50 ms':>8} {'p99 ms':>9} {'errors':>7} {'stream errs':>12}")
+    for kind in ("sync", "asgi"):
+        port = free_port()
+        proc = start_server(kind, port, args.workers)
+        try:
+            r = asyncio.run(burst(port, args.streams, args.burst, args.timeout))
+        finally:
+            stop_server(proc, port)
+        print(f"{kind:>6} {r['done/s']:>8.0f} {r['p50']:>8.1f} {r['p99']:>9.1f} "
+              f"{r['errors']:>7} {r['stream_errors']:>12}")
+
+
+if __name__ == "__main__":
+    main()
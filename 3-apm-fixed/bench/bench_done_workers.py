@@ -0,0 +1,93 @@
+"""/done throughput with 1..N pre-forked workers sharing the mmap counter store.
+
+Each worker is a werkzeug server accepting on one listening socket bound by
+the parent (the same pre-fork model gunicorn uses). Client processes hammer
+/done over keep-alive connections, then the final /ping count is checked to
+prove every worker incremented the same counter.
+
+    python bench/bench_done_workers.py --max-workers 4 --duration 5
+"""
+import argparse
+import http.client
+import multiprocessing as mp
+import os
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("DATABASE_URL", "sqlite://")  # /done never touches the DB
+# Cookie-less clients are new devices on every request; count each one
+# so the final /ping can be checked against requests sent
+os.environ.setdefault("DDTIMER_DONE_DEDUP", "0")
+
+
+def serve(fd, counter_file):
+    os.environ["DDTIMER_COUNTER_FILE"] = counter_file
+    import logging
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    make_server("127.0.0.1", 0, create_app(), fd=fd).serve_forever()
+
+
+def hammer(port, session, duration, results):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    sent = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        conn.request("GET", f"/done?session={session}")
+        conn.getresponse().read()
+        sent += 1
+    results.put(sent)
+
+
+def run(workers, clients, duration):
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(1024)
+    port = sock.getsockname()[1]
+    counter_file = tempfile.mktemp(prefix="ddtimer-bench-counters-")
+    ctx = mp.get_context("fork")
+    servers = [ctx.Process(target=serve, args=(sock.fileno(), counter_file)) for _ in range(workers)]
+    for p in servers:
+        p.start()
+    time.sleep(1.0)
+    try:
+        session = f"bench{workers}"
+        results = ctx.Queue()
+        procs = [ctx.Process(target=hammer, args=(port, session, duration, results)) for _ in range(clients)]
+        for p in procs:
+            p.start()
+        sent = sum(results.get() for _ in procs)
+        for p in procs:
+            p.join()
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        conn.request("GET", f"/ping?session={session}")
+        counted = int(conn.getresponse().read())
+    finally:
+        for p in servers:
+            p.terminate()
+        sock.close()
+        os.unlink(counter_file)
+    return sent / duration, sent, counted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--clients", type=int, default=0, help="client processes (default 2x workers)")
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'req/s':>10} {'sent':>8} {'counted':>8}")
+    for workers in range(1, args.max_workers + 1):
+        rps, sent, counted = run(workers, args.clients or 2 * workers, args.duration)
+        print(f"{workers:>7} {rps:>10.0f} {sent:>8} {counted:>8}" + ("" if sent == counted else "  MISMATCH"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Per-record logging cost on the request thread: old run.py setup vs app.logs.
+
+    python bench/bench_logging.py --records 50000
+
+Logs werkzeug-style access lines for /ping plus an application line with
+ddtrace correlation attributes, to /dev/null. "caller" is the time the
+logging call blocks the request thread; "drained" includes the listener
+thread finishing the queue.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.logs import configure_logging  # noqa: E402
+
+
+class LegacyJSONFormatter(logging.Formatter):
+    """The formatter run.py used before app.logs."""
+
+    def format(self, record):
+        log_data = {
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if hasattr(record, 'dd.trace_id'):
+            log_data['dd.trace_id'] = str(getattr(record, 'dd.trace_id'))
+        if hasattr(record, 'dd.span_id'):
+            log_data['dd.span_id'] = str(getattr(record, 'dd.span_id'))
+        if hasattr(record, 'dd.service'):
+            log_data['dd.service'] = getattr(record, 'dd.service')
+        if hasattr(record, 'dd.env'):
+            log_data['dd.env'] = getattr(record, 'dd.env')
+        if hasattr(record, 'dd.version'):
+            log_data['dd.version'] = getattr(record, 'dd.version')
+        return json.dumps(log_data)
+
+
+DD_EXTRA = {"dd.trace_id": "6710f3a20000000012ab34cd56ef7890", "dd.span_id": "1234567890",
+            "dd.service": "ddtimer", "dd.env": "lab", "dd.version": "1.0"}
+ACCESS_LINE = '127.0.0.1 - - [17/Oct/2026 10:00:00] "GET /ping?session=abc&since=3 HTTP/1.1" 200 -'
+
+
+def run(records):
+    access = logging.getLogger("werkzeug")
+    app_logger = logging.getLogger("app.routes")
+    start = time.perf_counter()
+    for i in range(records):
+        access.info(ACCESS_LINE)
+        app_logger.info("scan recorded for %s", "abc", extra=DD_EXTRA)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=50000)
+    args = parser.parse_args()
+    devnull = open(os.devnull, "w")
+
+    def per_record(seconds):
+        return seconds / (args.records * 2) * 1e6
+
+    root = logging.getLogger()
+
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(LegacyJSONFormatter())
+    root.setLevel(logging.INFO)
+    root.handlers = [handler]
+    legacy = run(args.records)
+
+    for sample in ("/ping=1", "/ping=0.01"):
+        os.environ["DDTIMER_ACCESS_LOG_SAMPLE"] = sample
+        logging.getLogger("werkzeug").filters.clear()
+        pipeline = configure_logging(stream=devnull)
+        start = time.perf_counter()
+        caller = run(args.records)
+        pipeline.stop()
+        drained = time.perf_counter() - start
+        print(f"queue {sample:<11} caller {per_record(caller):6.2f}  drained {per_record(drained):6.2f}"
+              f"  us/record (access lines dropped: {pipeline.sampler.dropped})")
+    print(f"legacy stream handler  caller {per_record(legacy):6.2f}  drained {per_record(legacy):6.2f}  us/record")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Per-request page render vs the precompressed page cache.
+
+    python bench/bench_pages.py --iterations 500
+
+Serves each page through the Flask test client, once per request with
+render_template (the old handler) and once from the page cache in each
+encoding, and prints the time per request and the bytes on the wire.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from flask import render_template  # noqa: E402
+
+from app import create_app  # noqa: E402
+
+PAGES = {"/": "popup.html", "/settings": "settings.html", "/qr-popup": "qr_popup.html"}
+
+
+def timed(client, path, headers, iterations):
+    size = len(client.get(path, headers=headers).data)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        client.get(path, headers=headers)
+    return (time.perf_counter() - start) / iterations * 1e6, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    app = create_app(production=True)
+    for path, template in PAGES.items():
+        # The pre-cache handler, side by side under its own URL
+        app.add_url_rule(f"/uncached{path}", f"uncached_{template}",
+                         lambda template=template: render_template(template))
+    client = app.test_client()
+
+    print(f"{'page':<10} {'variant':<9} {'us/req':>8} {'bytes':>7}")
+    for path in PAGES:
+        us, size = timed(client, f"/uncached{path}", {}, args.iterations)
+        print(f"{path:<10} {'render':<9} {us:>8.1f} {size:>7}")
+        for encoding in ("identity", "gzip", "br"):
+            us, size = timed(client, path, {"Accept-Encoding": encoding}, args.iterations)
+            print(f"{path:<10} {encoding:<9} {us:>8.1f} {size:>7}")
+
+
+if __name__ == "__main__":
+    main()
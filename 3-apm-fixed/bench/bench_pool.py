@@ -0,0 +1,97 @@
+"""Where /api/session-state starts waiting on the connection pool.
+
+Runs the app under gunicorn (one worker, --threads request threads) with a
+deliberately small pool and the state cache off, so every GET checks out a
+connection. It then steps up the number of concurrent clients and prints
+throughput, latency, and the mean time a checkout waited for a free
+connection (from /api/stats). Saturation begins where pool wait stops
+being ~0 and starts growing with concurrency while throughput flattens.
+
+    python bench/bench_pool.py --database-url postgresql+psycopg2://... --pool-size 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from httpload import Connection, free_port, percentile, start_server, stop_server  # noqa: E402
+
+
+def pool_totals(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/stats") as response:
+        pool = json.load(response)["db_pool"]
+    return pool["checkouts"], pool["wait_mean_ms"] * pool["checkouts"], pool["timeouts"]
+
+
+async def step(port, clients, duration, sessions):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def client(n):
+        nonlocal errors
+        conn = Connection("127.0.0.1", port)
+        i = n
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status, _, _ = await conn.request("GET", f"/api/session-state?session=pool-{i % sessions}")
+            except Exception:
+                errors += 1
+                await conn.close()
+                continue
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+            i += 1
+        await conn.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return len(latencies) / elapsed, percentile(latencies, 50), percentile(latencies, 95), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"), required=False)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--max-overflow", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--clients", default="1,2,4,8,16,32")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--sessions", type=int, default=20)
+    args = parser.parse_args()
+    if not (args.database_url or "").startswith("postgres"):
+        parser.error("needs a Postgres --database-url (SQLite has no connection pool to saturate)")
+
+    port = free_port()
+    proc = start_server("sync", port, env={
+        "DATABASE_URL": args.database_url,
+        "DDTIMER_THREADS": str(args.threads),
+        "DDTIMER_DB_POOL_SIZE": str(args.pool_size),
+        "DDTIMER_DB_MAX_OVERFLOW": str(args.max_overflow),
+        "DDTIMER_STATE_CACHE_SIZE": "0",
+    })
+    try:
+        print(f"pool_size={args.pool_size} max_overflow={args.max_overflow} threads={args.threads}")
+        print(f"{'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'pool wait ms':>13} {'timeouts':>9} {'errors':>7}")
+        for clients in (int(c) for c in args.clients.split(",")):
+            checkouts, waited, timeouts = pool_totals(port)
+            rate, p50, p95, errors = asyncio.run(step(port, clients, args.duration, args.sessions))
+            checkouts2, waited2, timeouts2 = pool_totals(port)
+            mean_wait = (waited2 - waited) / max(checkouts2 - checkouts, 1)
+            print(f"{clients:>7} {rate:>8.0f} {p50 * 1000:>8.1f} {p95 * 1000:>8.1f} {mean_wait:>13.2f}"
+                  f" {timeouts2 - timeouts:>9} {errors:>7}")
+    finally:
+        stop_server(proc, port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Cold vs warm QR generation for /qr-image.
+
+    python bench/bench_qr.py --iterations 200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.qr import render_qr  # noqa: E402
+
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'format':>6} {'cold us':>10} {'warm us':>10} {'bytes':>7}")
+    for fmt in ("png", "svg"):
+        def cold(i):
+            render_qr.cache_clear()
+            render_qr("SESSION1", fmt)
+
+        render_qr("SESSION1", fmt)
+        warm_us = timed(lambda i: render_qr("SESSION1", fmt), args.iterations * 100)
+        cold_us = timed(cold, args.iterations)
+        size = len(render_qr("SESSION1", fmt)[0])
+        print(f"{fmt:>6} {cold_us:>10.1f} {warm_us:>10.2f} {size:>7}")
+
+
+if __name__ == "__main__":
+    main()
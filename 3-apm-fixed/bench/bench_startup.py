@@ -0,0 +1,79 @@
+"""Cold-start time of `import run` with a per-module import-time breakdown.
+
+    python bench/bench_startup.py --runs 5 --budget-ms 2000
+
+Each run is a fresh interpreter with -X importtime (against a throwaway
+SQLite database), as a worker or container restart would be. Prints the
+median wall time and the slowest top-level imports of the median run, and
+exits non-zero when the median exceeds --budget-ms or a module listed in
+--lazy (default: qrcode, PIL.Image) was imported at startup.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+LAZY_MODULES = ("qrcode", "PIL.Image")
+# Median `import run` on a 1-CPU lab box is ~1.4 s; fail well before 2x that
+STARTUP_BUDGET_MS = 2000
+
+
+def run_once(env):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import run"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    wall = time.perf_counter() - start
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(cumulative_us)
+        except ValueError:
+            continue  # the header line
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (cumulative, depth)
+    return wall, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--lazy", nargs="*", default=list(LAZY_MODULES),
+                        help="modules that must not be imported at startup")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="ddtimer-startup-")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp}/bench.db")
+    runs = sorted((run_once(env) for _ in range(args.runs)), key=lambda run: run[0])
+    wall, modules = runs[len(runs) // 2]
+
+    print(f"import run: median {statistics.median(r[0] for r in runs) * 1000:.0f} ms "
+          f"(min {runs[0][0] * 1000:.0f}, max {runs[-1][0] * 1000:.0f}) over {args.runs} runs")
+    print(f"\n{'cumulative ms':>14}  module (top-level imports of the median run)")
+    top_level = sorted(((us, name) for name, (us, depth) in modules.items() if depth <= 1), reverse=True)
+    for us, name in top_level[:args.top]:
+        print(f"{us / 1000:>14.1f}  {name}")
+
+    failed = False
+    eager = [name for name in args.lazy if name in modules]
+    if eager:
+        print(f"\nFAIL: imported at startup but meant to load on first use: {', '.join(eager)}")
+        failed = True
+    if args.budget_ms is not None and wall * 1000 > args.budget_ms:
+        print(f"\nFAIL: median start-up {wall * 1000:.0f} ms exceeds the {args.budget_ms:.0f} ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
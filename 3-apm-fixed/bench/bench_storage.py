@@ -0,0 +1,136 @@
+"""The same session-state read/write mix against each storage backend.
+
+Every backend runs in its own interpreter (the store is chosen from
+DATABASE_URL at import) with --threads threads for --duration seconds.
+Each operation is picked at random by --mix: get_session_state_versioned,
+set_session_state of a full settings document, or a small merge patch,
+over --sessions sessions seeded from the golden standard.
+
+    python bench/bench_storage.py --postgres-url postgresql+psycopg2://... --threads 8
+
+Without --postgres-url only memory:// and SQLite (WAL, a temp file) run.
+Postgres reads are served by the state cache unless --no-cache is given.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+OPERATIONS = ("get", "set", "patch")
+
+
+def worker(args):
+    sys.path.insert(0, ROOT)
+    from app import create_app, db
+    from app.routes import (
+        _load_golden_standard, get_session_state_versioned, patch_session_state, set_session_state,
+        set_session_states,
+    )
+
+    app = create_app()
+    document = _load_golden_standard()
+    prefix = f"bench-{os.getpid()}"
+    sessions = [f"{prefix}-{i}" for i in range(args.sessions)]
+    with app.app_context():
+        db.create_all()
+        set_session_states({sid: document for sid in sessions})
+        db.session.remove()
+
+    weights = [float(w) for w in args.mix.split(",")]
+    latencies = {op: [] for op in OPERATIONS}
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def run(n):
+        rng = random.Random(n)
+        local = {op: [] for op in OPERATIONS}
+        failed = 0
+        with app.app_context():
+            while time.perf_counter() < deadline:
+                op = rng.choices(OPERATIONS, weights)[0]
+                sid = rng.choice(sessions)
+                start = time.perf_counter()
+                try:
+                    if op == "get":
+                        get_session_state_versioned(sid)
+                    elif op == "set":
+                        set_session_state(sid, dict(document, minutes=rng.randrange(60)))
+                    else:
+                        patch_session_state(sid, {"seconds": rng.randrange(60)})
+                except Exception:
+                    db.session.rollback()
+                    failed += 1
+                    continue
+                finally:
+                    db.session.remove()
+                local[op].append(time.perf_counter() - start)
+        with lock:
+            for op in OPERATIONS:
+                latencies[op].extend(local[op])
+            errors.append(failed)
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(args.threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    result = {"ops/s": sum(len(v) for v in latencies.values()) / elapsed, "errors": sum(errors)}
+    for op, values in latencies.items():
+        values.sort()
+        ms = [v * 1000 for v in values] or [0.0]
+        result[op] = {"p50": statistics.median(ms), "p99": ms[int(len(ms) * 0.99)]}
+    json.dump(result, sys.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--postgres-url", default=None)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--mix", default="90,5,5", help="get,set,patch weights")
+    parser.add_argument("--no-cache", action="store_true", help="disable the Postgres state cache")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        return worker(args)
+
+    tmp = tempfile.mkdtemp(prefix="ddtimer-storage-")
+    backends = [("memory", "memory://"), ("sqlite", f"sqlite:///{tmp}/bench.db")]
+    if args.postgres_url:
+        backends.append(("postgres", args.postgres_url))
+
+    print(f"threads={args.threads} sessions={args.sessions} mix get,set,patch={args.mix}")
+    print(f"{'backend':>9} {'ops/s':>8} " + " ".join(f"{op + ' p50':>10} {op + ' p99':>10}" for op in OPERATIONS)
+          + f" {'errors':>7}")
+    for name, url in backends:
+        env = dict(os.environ, DATABASE_URL=url, DDTIMER_COUNT_FLUSH_INTERVAL="0")
+        if args.no_cache:
+            env["DDTIMER_STATE_CACHE_SIZE"] = "0"
+        proc = subprocess.run(
+            [sys.executable, __file__, "--worker", "--threads", str(args.threads),
+             "--duration", str(args.duration), "--sessions", str(args.sessions), "--mix", args.mix],
+            cwd=ROOT, env=env, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"{name:>9} failed:\n{proc.stderr}")
+            continue
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(f"{name:>9} {r['ops/s']:>8.0f} "
+              + " ".join(f"{r[op]['p50']:>10.3f} {r[op]['p99']:>10.3f}" for op in OPERATIONS)
+              + f" {r['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
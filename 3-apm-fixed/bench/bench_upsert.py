@@ -0,0 +1,103 @@
+"""set_session_state latency under concurrent writers: select-then-write vs upsert.
+
+Every writer saves the same rotating set of brand-new session IDs, so the
+legacy path also shows how often concurrent first-time saves collide on the
+unique constraint. Needs a Postgres DATABASE_URL.
+
+    DATABASE_URL=postgresql://... python bench/bench_upsert.py --writers 8
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app import create_app, db  # noqa: E402
+from app.models import SessionState  # noqa: E402
+from app.routes import set_session_state, set_session_states  # noqa: E402
+
+
+def legacy_set_session_state(session_id, state):
+    # The pre-upsert implementation: SELECT, then UPDATE or INSERT, then COMMIT
+    record = SessionState.query.filter_by(session_id=session_id).first()
+    if record:
+        record.state = state
+    else:
+        record = SessionState(session_id=session_id, state=state)
+        db.session.add(record)
+    db.session.commit()
+
+
+def run(app, fn, writers, writes, sessions):
+    prefix = uuid.uuid4().hex[:8]
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def writer(n):
+        local, failed = [], 0
+        with app.app_context():
+            for i in range(writes):
+                sid = f"{prefix}-{i % sessions}"
+                start = time.perf_counter()
+                try:
+                    fn(sid, {"minutes": i, "writer": n})
+                except Exception:
+                    db.session.rollback()
+                    failed += 1
+                local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    ms = [x * 1000 for x in latencies]
+    return {
+        "ops/s": len(ms) / elapsed,
+        "p50": statistics.median(ms),
+        "p95": ms[int(len(ms) * 0.95)],
+        "errors": sum(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=500, help="writes per writer")
+    parser.add_argument("--sessions", type=int, default=50, help="distinct sessions per run")
+    parser.add_argument("--bulk", type=int, default=200, help="sessions written by the bulk variant")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+
+    print(f"{'path':>8} {'ops/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for name, fn in (("legacy", legacy_set_session_state), ("upsert", set_session_state)):
+        r = run(app, fn, args.writers, args.writes, args.sessions)
+        print(f"{name:>8} {r['ops/s']:>8.0f} {r['p50']:>8.2f} {r['p95']:>8.2f} {r['errors']:>7}")
+
+    with app.app_context():
+        states = {f"bulk-{uuid.uuid4().hex[:8]}-{i}": {"minutes": i} for i in range(args.bulk)}
+        start = time.perf_counter()
+        set_session_states(states)
+        bulk_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        for sid, state in states.items():
+            set_session_state(sid, state)
+        single_ms = (time.perf_counter() - start) * 1000
+    print(f"bulk upsert of {args.bulk} sessions: {bulk_ms:.1f} ms (one-by-one: {single_ms:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Minimal asyncio HTTP/1.1 client and server launcher shared by the benchmarks.
+
+Only what the benchmarks need: keep-alive GET/POST with Content-Length or
+chunked bodies, plus opening a response and leaving it streaming.
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+class Connection:
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def send(self, method, path, headers=None, body=b""):
+        if self.writer is None:
+            await self._connect()
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        if body or method in ("POST", "PUT", "PATCH"):
+            lines.append(f"Content-Length: {len(body)}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed")
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+        return status, response_headers
+
+    async def request(self, method, path, headers=None, body=b""):
+        """Send a request and read the whole response; returns (status, headers, body)."""
+        try:
+            status, response_headers = await self.send(method, path, headers, body)
+        except (ConnectionError, OSError):
+            # Server closed an idle keep-alive connection; retry once on a fresh one
+            await self.close()
+            status, response_headers = await self.send(method, path, headers, body)
+        if "content-length" in response_headers:
+            data = await self.reader.readexactly(int(response_headers["content-length"]))
+        elif response_headers.get("transfer-encoding") == "chunked":
+            data = b""
+            while True:
+                size = int((await self.reader.readline()).strip(), 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                data += chunk[:-2]
+        else:
+            data = b"" if status == 304 else await self.reader.read()
+        if response_headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, response_headers, data
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+        self.reader = self.writer = None
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, port, workers=1, env=None):
+    """Launch the app under gunicorn ("sync") or uvicorn ("asgi") and wait for it."""
+    env = dict(os.environ, **(env or {}))
+    env.setdefault("DATABASE_URL", "sqlite://")
+    env.setdefault("DD_TRACE_ENABLED", "false")
+    if workers > 1:
+        env.setdefault("DDTIMER_COUNTER_FILE", f"/dev/shm/ddtimer-bench-{port}")
+    if kind == "sync":
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+               "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+               "--access-logfile", "/dev/null"]
+    elif kind == "asgi":
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:application", "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--no-access-log",
+               "--log-level", "warning", "--backlog", "4096"]
+    else:
+        raise ValueError(f"unknown server kind {kind!r}")
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/ping", timeout=1).read()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{kind} server exited with {proc.returncode}")
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{kind} server did not start on port {port}")
+
+
+def stop_server(proc, port=None):
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+    if port is not None and os.path.exists(f"/dev/shm/ddtimer-bench-{port}"):
+        os.unlink(f"/dev/shm/ddtimer-bench-{port}")
@@ -0,0 +1,207 @@
+"""Load test modelling a live lab; writes per-endpoint latency percentiles as JSON.
+
+Simulated traffic:
+  * N popup displays polling /ping every 2s
+  * M settings pages polling /api/session-state every 5s (with If-None-Match)
+  * P popup page loads spread over the run (/, /api/golden-standard,
+    /api/session-state, /qr-image, /ping)
+  * a burst of K students hitting /done at --burst-at seconds
+
+By default the app is started locally under gunicorn against a throwaway
+SQLite database; pass --database-url for a local Postgres, or --url to aim at
+a server that is already running.
+
+    python bench/loadtest.py --displays 50 --settings 10 --students 300 \
+        --duration 30 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from httpload import ROOT, Connection, free_port, percentile, start_server, stop_server  # noqa: E402
+
+SESSION = "LOADTEST"
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    async def call(self, conn, method, path, headers=None, body=b""):
+        endpoint = path.split("?", 1)[0]
+        start = time.perf_counter()
+        try:
+            status, response_headers, data = await conn.request(method, path, headers, body)
+        except Exception:
+            self.errors[endpoint] += 1
+            await conn.close()
+            return None, {}, b""
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        self.statuses[endpoint][status] += 1
+        if status >= 500:
+            self.errors[endpoint] += 1
+        return status, response_headers, data
+
+    def report(self, duration):
+        endpoints = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies[endpoint])
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "errors": self.errors[endpoint],
+                "throughput": len(values) / duration,
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "statuses": dict(self.statuses[endpoint]),
+            }
+        return endpoints
+
+
+async def display(rec, host, port, stop_at):
+    conn = Connection(host, port)
+    await asyncio.sleep(random.uniform(0, 2))
+    while time.monotonic() < stop_at:
+        await rec.call(conn, "GET", f"/ping?session={SESSION}")
+        await asyncio.sleep(2)
+    await conn.close()
+
+
+async def settings_page(rec, host, port, stop_at):
+    conn = Connection(host, port)
+    etag = None
+    await asyncio.sleep(random.uniform(0, 5))
+    while time.monotonic() < stop_at:
+        headers = {"If-None-Match": etag} if etag else {}
+        status, response_headers, _ = await rec.call(
+            conn, "GET", f"/api/session-state?session={SESSION}", headers
+        )
+        if status == 200:
+            etag = response_headers.get("etag")
+        await asyncio.sleep(5)
+    await conn.close()
+
+
+async def page_load(rec, host, port, delay):
+    await asyncio.sleep(delay)
+    conn = Connection(host, port)
+    for path in ("/", "/api/golden-standard", f"/api/session-state?session={SESSION}",
+                 f"/qr-image?session={SESSION}", f"/ping?session={SESSION}"):
+        await rec.call(conn, "GET", path)
+    await conn.close()
+
+
+async def student(rec, host, port, delay):
+    await asyncio.sleep(delay)
+    conn = Connection(host, port)
+    await rec.call(conn, "GET", f"/done?session={SESSION}")
+    await conn.close()
+
+
+async def run(host, port, args):
+    rec = Recorder()
+    seed = Connection(host, port)
+    await seed.request("POST", f"/api/session-state?session={SESSION}",
+                       {"Content-Type": "application/json"},
+                       json.dumps({"minutes": 5, "red_teams": args.students}).encode())
+    await seed.request("POST", f"/reset?session={SESSION}")
+    await seed.close()
+
+    start = time.monotonic()
+    stop_at = start + args.duration
+    tasks = [display(rec, host, port, stop_at) for _ in range(args.displays)]
+    tasks += [settings_page(rec, host, port, stop_at) for _ in range(args.settings)]
+    tasks += [page_load(rec, host, port, random.uniform(0, args.duration)) for _ in range(args.page_loads)]
+    # Students scan within a couple of seconds of the facilitator saying "go"
+    tasks += [student(rec, host, port, args.burst_at + random.uniform(0, args.burst_spread))
+              for _ in range(args.students)]
+    await asyncio.gather(*tasks)
+    duration = time.monotonic() - start
+    return rec.report(duration), duration
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="target an already running server instead of starting one")
+    parser.add_argument("--server", choices=("sync", "asgi"), default="sync")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--database-url", help="default: a temporary SQLite file")
+    parser.add_argument("--displays", type=int, default=50)
+    parser.add_argument("--settings", type=int, default=10)
+    parser.add_argument("--page-loads", type=int, default=20)
+    parser.add_argument("--students", type=int, default=300)
+    parser.add_argument("--burst-at", type=float, default=5.0)
+    parser.add_argument("--burst-spread", type=float, default=2.0)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    proc = port = None
+    tmpdir = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+        database_url = None
+    else:
+        database_url = args.database_url
+        if database_url is None:
+            tmpdir = tempfile.TemporaryDirectory()
+            database_url = f"sqlite:///{tmpdir.name}/loadtest.db"
+        env = dict(os.environ, DATABASE_URL=database_url)
+        subprocess.run([sys.executable, "init_db.py"], cwd=ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        host, port = "127.0.0.1", free_port()
+        proc = start_server(args.server, port, args.workers, {"DATABASE_URL": database_url})
+    try:
+        endpoints, duration = asyncio.run(run(host, port, args))
+    finally:
+        if proc is not None:
+            stop_server(proc, port)
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "target": args.url or f"{args.server} x{args.workers} on {database_url.split(':', 1)[0]}",
+        "scenario": {k: getattr(args, k) for k in
+                     ("displays", "settings", "page_loads", "students", "burst_at", "duration")},
+        "duration_s": duration,
+        "total_throughput": sum(e["requests"] for e in endpoints.values()) / duration,
+        "endpoints": endpoints,
+    }
+    print(f"{'endpoint':<22} {'reqs':>6} {'err':>4} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, e in endpoints.items():
+        print(f"{endpoint:<22} {e['requests']:>6} {e['errors']:>4} {e['throughput']:>7.1f} "
+              f"{e['p50_ms']:>8.1f} {e['p95_ms']:>8.1f} {e['p99_ms']:>8.1f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Build resized background variants of the images bundled in app/static.
+
+    python build_variants.py
+
+Runs once at image build time, so workers don't each convert the bundled
+backgrounds on their first /bg/ requests. Uploaded backgrounds are still
+built by the app when they arrive.
+"""
+import os
+import sys
+
+from app.backgrounds import BackgroundVariants
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app", "static")
+
+
+def main():
+    backgrounds = BackgroundVariants()
+    backgrounds.init_dirs(STATIC_DIR)
+    failed = 0
+    for name in backgrounds.bundled_images():
+        try:
+            manifest = backgrounds.process(name)
+        except Exception as exc:
+            print(f"{name}: {exc}", file=sys.stderr)
+            failed += 1
+            continue
+        print(f"{name}: {len(manifest['variants'])} variants")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
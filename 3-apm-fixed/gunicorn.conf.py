@@ -0,0 +1,89 @@
+# Production server configuration: gunicorn -c gunicorn.conf.py
+#
+# The app is imported once in the master (preload_app), so ddtrace patching
+# and JSON logging in run.py happen before workers are forked. Tune with:
+#   WEB_CONCURRENCY        worker processes (default: 2 x usable CPUs + 1, at most
+#                          8; 1 for memory://)
+#   DDTIMER_DB_MAX_CONNECTIONS
+#                          Postgres connections all workers may open together
+#                          (default: 80, under Postgres' max_connections=100).
+#                          Each worker holds its pool, DDTIMER_DB_MAX_OVERFLOW
+#                          more and one LISTEN connection, so the per-worker
+#                          pool shrinks as WEB_CONCURRENCY grows (app/pool.py).
+#   DDTIMER_THREADS        threads per worker handed Flask requests (default: 8)
+#   DDTIMER_WORKER_CLASS   uvicorn (default), or gthread / gevent (needs gevent +
+#                          psycogreen) to serve the plain WSGI app instead
+#
+# uvicorn workers serve asgi:application: /done, /ping and the SSE streams
+# run on the event loop, and everything else goes to a2wsgi's thread pool.
+# Under gthread every open stream holds one of the worker's threads, so a
+# handful of displays can starve /done; only choose it deliberately.
+import os
+
+os.environ.setdefault("DDTIMER_PRODUCTION", "1")
+
+bind = os.environ.get("DDTIMER_BIND", "0.0.0.0:5050")
+MAX_DEFAULT_WORKERS = 8
+
+
+def usable_cpus():
+    # cpu_count() is the host's cores, not the CPUs this container may run on
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# memory:// session states live in one process; don't split them across workers
+if os.environ.get("DATABASE_URL", "").startswith("memory:"):
+    default_workers = 1
+else:
+    default_workers = min(usable_cpus() * 2 + 1, MAX_DEFAULT_WORKERS)
+workers = int(os.environ.get("WEB_CONCURRENCY", default_workers))
+# Read by app/pool.py to split DDTIMER_DB_MAX_CONNECTIONS between workers
+os.environ["DDTIMER_WORKERS"] = str(workers)
+threads = int(os.environ.get("DDTIMER_THREADS", 8))
+worker_mode = os.environ.get("DDTIMER_WORKER_CLASS", "uvicorn")
+worker_class = "uvicorn_worker.UvicornWorker" if worker_mode == "uvicorn" else worker_mode
+os.environ.setdefault("DDTIMER_THREADS", str(threads))
+wsgi_app = "asgi:application" if worker_mode == "uvicorn" else "run:app"
+preload_app = True
+# /ping/stream responses are long-lived; don't let the worker timeout kill them
+timeout = 0 if worker_mode == "gevent" else 60
+keepalive = 5
+accesslog = "-"
+
+if workers > 1:
+    # Every worker must see the same /done counts
+    os.environ.setdefault("DDTIMER_COUNTER_FILE", "/dev/shm/ddtimer-counters")
+    # /metrics sums one file per worker
+    os.environ.setdefault("DDTIMER_METRICS_DIR", "/dev/shm/ddtimer-metrics")
+
+
+def on_starting(server):
+    from app.metrics import clear_directory
+
+    clear_directory()
+
+
+def child_exit(server, worker):
+    # Fold the worker's /metrics file into metrics-dead.db before its PID is reused
+    from app.metrics import metrics
+
+    metrics.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # Never share pooled DB connections opened in the master with a child
+    from run import app
+    from app import db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    if worker_mode == "gevent":
+        from psycogreen.gevent import patch_psycopg
+
+        patch_psycopg()
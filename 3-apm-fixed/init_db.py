@@ -1,6 +1,17 @@
 from app import create_app, db
 
+# Columns added after the first release; create_all() won't add them to an
+# existing table
+UPGRADES = [
+    "ALTER TABLE session_states ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+    "ALTER TABLE session_states ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+]
+
 app = create_app()
 with app.app_context():
     db.create_all()
+    if db.engine.dialect.name == "postgresql":
+        for statement in UPGRADES:
+            db.session.execute(db.text(statement))
+        db.session.commit()
     print("Database tables created.")
\ No newline at end of file
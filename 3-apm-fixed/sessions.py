@@ -0,0 +1,50 @@
+"""Back up and restore session_states as NDJSON.
+
+    python sessions.py export -o sessions.ndjson
+    python sessions.py import sessions.ndjson          # or - for stdin
+    python sessions.py import-legacy config/session_states.json
+"""
+import argparse
+import sys
+
+from app import create_app, db
+from app.session_io import export_ndjson, import_sessions, iter_legacy_sessions, read_ndjson
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write every session as one JSON line")
+    export.add_argument("-o", "--output", default="-", help="file to write (default: stdout)")
+    load = commands.add_parser("import", help="upsert sessions from an NDJSON export")
+    load.add_argument("file", nargs="?", default="-", help="file to read (default: stdin)")
+    legacy = commands.add_parser("import-legacy", help="upsert sessions from a session_states.json file")
+    legacy.add_argument("file")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.command == "export":
+            out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+            try:
+                count = export_ndjson(out)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+            print(f"Exported {count} sessions.", file=sys.stderr)
+            return
+        f = sys.stdin if args.file == "-" else open(args.file, encoding="utf-8")
+        try:
+            rows = read_ndjson(f) if args.command == "import" else iter_legacy_sessions(f)
+            count = import_sessions(rows)
+        except ValueError as exc:
+            db.session.rollback()
+            sys.exit(f"{args.file}: {exc}")
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        print(f"Imported {count} sessions.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()